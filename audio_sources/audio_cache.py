@@ -0,0 +1,117 @@
+import os
+import re
+import threading
+import uuid
+
+
+AUDIO_CACHE_DIR = os.environ.get('AUDIO_STREAMER_AUDIO_CACHE', 'audio_cache')
+AUDIO_CACHE_SIZE = 1024 ** 3  # 1 GiB
+
+
+class AudioCache:
+    """
+    Directory of downloaded audio files, named by extractor,
+    video id and format, shared by all guilds.
+
+    Files which are being played are reference-counted and never
+    evicted, others are evicted least-recently-used first when
+    directory grows over `max_size`.
+    """
+    def __init__(self, directory: str = AUDIO_CACHE_DIR,
+                 *, max_size: int = AUDIO_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._refs = {}  # path -> number of songs using it
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(info: dict):
+        key = f'{info.get("extractor", "generic")}-{info["id"]}-{info.get("format_id", "best")}'
+        return re.sub(r'[^\w.-]', '_', key)
+
+    def path(self, info: dict):
+        return os.path.join(self.directory, f'{self.key(info)}.{info.get("ext", "audio")}')
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'in_use': len(self._refs),
+        }
+
+    def lookup(self, info: dict):
+        """
+        Returns path of cached file or `None`.
+        """
+        path = self.path(info)
+        try:
+            # access time is used for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def contains(self, info: dict):
+        """
+        Whether file of `info` is cached, without counting it as lookup.
+        """
+        return os.path.isfile(self.path(info))
+
+    def store(self, info: dict, download):
+        """
+        Calls `download(tmp_path)` and atomically moves downloaded
+        file into cache. Blocking, should be called from executor.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        path = self.path(info)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            download(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+        # fresh file is about to be played, so it's kept
+        self.evict(keep=path)
+        return path
+
+    def acquire(self, path: str):
+        with self._lock:
+            self._refs[path] = self._refs.get(path, 0) + 1
+
+        return path
+
+    def release(self, path: str):
+        with self._lock:
+            self._refs[path] -= 1
+            if not self._refs[path]:
+                del self._refs[path]
+
+    def evict(self, *, keep: str = None):
+        with self._lock:
+            files = []
+            for entry in os.scandir(self.directory):
+                # skip downloads in progress
+                if entry.is_file() and not entry.name.endswith(('.tmp', '.part')):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+            size = sum(file_size for _, file_size, _ in files)
+            for _, file_size, path in sorted(files):
+                if size <= self.max_size:
+                    break
+                if path in self._refs or path == keep:
+                    continue
+
+                os.remove(path)
+                size -= file_size
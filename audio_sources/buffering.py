@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from collections import deque
+
+import discord
+
+
+# depth of read-ahead buffer between FFmpeg and voice send loop, 0 disables it
+READ_AHEAD_MS = int(os.environ.get('AUDIO_STREAMER_READ_AHEAD', 0))
+FRAME_MS = 20  # Discord frame length
+
+
+class PrebufferedSource(discord.AudioSource):
+    """
+    Source whose first frames can be decoded ahead of time with `fill()`,
+    e.g. while previous song is still playing, so playback starts
+    without waiting for FFmpeg to spawn and connect.
+    """
+    def __init__(self, original: discord.AudioSource):
+        self.original = original
+        self.started = False
+        self.filled_at = None
+
+        self._frames = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """
+        Bytes of frames held in memory.
+        """
+        with self._lock:
+            return sum(len(frame) for frame in self._frames)
+
+    def fill(self, count: int):
+        """
+        Decodes up to `count` frames in advance. Blocking,
+        should be called from executor. Stops as soon as playback starts.
+        """
+        for _ in range(count):
+            with self._lock:
+                if self.started:
+                    break
+
+                frame = self.original.read()
+                if not frame:
+                    break
+                self._frames.append(frame)
+
+        self.filled_at = time.monotonic()
+
+    def read(self):
+        with self._lock:
+            self.started = True
+            if self._frames:
+                return self._frames.popleft()
+
+        return self.original.read()
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+class ReadAheadSource(discord.AudioSource):
+    """
+    Reads `original` source on its own thread into bounded buffer
+    of `depth` ms of frames, so short stalls of FFmpeg (e.g. while it
+    reconnects to server) don't reach voice send loop.
+
+    `totals` accumulates counters of all sources:
+    underruns (buffer ran dry during playback) and time spent waiting for refill.
+    """
+    totals = {'underruns': 0, 'stalled': 0.0}
+
+    def __init__(self, original: discord.AudioSource, depth: int = READ_AHEAD_MS):
+        self.original = original
+        self.capacity = max(depth // FRAME_MS, 1)
+
+        self.underruns = 0
+        self.stalled = 0.0  # seconds voice send loop waited for frames
+        self.max_stall = 0.0
+        self._reads = 0
+        self._read_time = 0.0  # seconds spent in `original.read()`
+        self._started = False
+
+        self._frames = deque()
+        self._done = False
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run, name='read-ahead', daemon=True)
+        self._thread.start()
+
+    @property
+    def stats(self):
+        with self._condition:
+            return {
+                'depth': self.capacity * FRAME_MS,
+                'fill': len(self._frames) * FRAME_MS,
+                'underruns': self.underruns,
+                'max_stall': self.max_stall,
+                'avg_read': self._read_time / self._reads if self._reads else 0.0,
+            }
+
+    @property
+    def size(self):
+        """
+        Bytes of frames held in memory.
+        """
+        with self._condition:
+            return sum(len(frame) for frame in self._frames)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self._frames) >= self.capacity and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+
+            # FFmpeg is read outside of lock, so consumer isn't blocked
+            start = time.perf_counter()
+            frame = self.original.read()
+            elapsed = time.perf_counter() - start
+
+            with self._condition:
+                self._reads += 1
+                self._read_time += elapsed
+                if frame:
+                    self._frames.append(frame)
+                else:
+                    self._done = True
+                self._condition.notify_all()
+
+            if not frame:
+                return
+
+    def read(self):
+        with self._condition:
+            if not self._frames and not self._done:
+                start = time.perf_counter()
+                while not self._frames and not self._done:
+                    self._condition.wait()
+
+                # waiting for the first frame is startup, not underrun
+                if self._started:
+                    stall = time.perf_counter() - start
+                    self.underruns += 1
+                    self.stalled += stall
+                    self.max_stall = max(self.max_stall, stall)
+                    self.totals['underruns'] += 1
+                    self.totals['stalled'] += stall
+
+            self._started = True
+            if not self._frames:
+                return b''
+
+            frame = self._frames.popleft()
+            self._condition.notify_all()
+            return frame
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        with self._condition:
+            self._closed = self._done = True
+            self._condition.notify_all()
+        # pending `original.read()` returns as soon as FFmpeg is killed
+        self.original.cleanup()
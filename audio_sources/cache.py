@@ -0,0 +1,192 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+
+METADATA_CACHE_PATH = os.environ.get('AUDIO_STREAMER_CACHE', 'ytdl_cache.sqlite3')
+METADATA_CACHE_SIZE = 512  # entries kept in memory
+METADATA_TTL = 7 * 24 * 3600  # 1 week
+STREAM_URL_TTL = 60 * 60  # 1 hour, YouTube stream urls expire after ~6 hours
+PURGE_INTERVAL = 256  # writes between deletions of expired rows
+
+# heavy fields of `info` dict which are never used after resolution
+DROPPED_FIELDS = (
+    'formats',
+    'requested_formats',
+    'thumbnails',
+    'subtitles',
+    'automatic_captions',
+    'requested_subtitles',
+)
+
+
+class MetadataCache:
+    """
+    Two-level (in-memory LRU + SQLite on disk) cache of
+    youtube-dl `info` dicts, keyed by normalized search/URL.
+
+    Stable metadata (title, duration, etc.) lives for `metadata_ttl`,
+    while stream `url` is considered fresh only for `stream_ttl`.
+    """
+    def __init__(self, path: str = METADATA_CACHE_PATH,
+                 *, max_entries: int = METADATA_CACHE_SIZE,
+                 metadata_ttl: int = METADATA_TTL,
+                 stream_ttl: int = STREAM_URL_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.metadata_ttl = metadata_ttl
+        self.stream_ttl = stream_ttl
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+        # key -> (info, resolved_at, stream_resolved_at)
+        self._memory = OrderedDict()
+        self._db = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    @staticmethod
+    def normalize(search: str):
+        """
+        Turns search string or URL into cache key:
+        keywords are lowercased and whitespace-collapsed,
+        YouTube links are reduced to video id.
+        """
+        search = ' '.join(search.split())
+
+        if not re.match(r'^https?://', search):
+            return search.lower()
+
+        url = urlparse(search)
+        host = url.netloc.lower()
+        if host.startswith('www.') or host.startswith('m.'):
+            host = host.split('.', 1)[1]
+
+        if host == 'youtu.be' and url.path.strip('/'):
+            return f'youtube:{url.path.strip("/")}'
+        if host == 'youtube.com' and url.path == '/watch':
+            video_id = parse_qs(url.query).get('v')
+            if video_id:
+                return f'youtube:{video_id[0]}'
+
+        return f'{host}{url.path}' + (f'?{url.query}' if url.query else '')
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'memory_entries': len(self._memory),
+        }
+
+    def get(self, key: str):
+        """
+        Returns tuple `(info, stream_is_fresh)` or `None` on miss.
+        Might touch disk, so should be called from executor.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            else:
+                entry = self._load(key)
+                if entry is not None:
+                    self._remember(key, entry)
+
+            now = time.time()
+            if entry is None or now - entry[1] > self.metadata_ttl:
+                self.misses += 1
+                return None
+
+            if now - entry[2] > self.stream_ttl:
+                self.stale_hits += 1
+                return entry[0], False
+
+            self.hits += 1
+            return entry[0], True
+
+    def put(self, key: str, info: dict, *, stream_resolved_at: float = None):
+        info = {k: v for k, v in info.items() if k not in DROPPED_FIELDS}
+        now = time.time()
+        entry = (info, now, stream_resolved_at or now)
+
+        with self._lock:
+            self._remember(key, entry)
+            self._store(key, entry)
+
+        return info
+
+    def annotate(self, key: str, **fields):
+        """
+        Adds `fields` to cached `info` without changing its TTLs.
+        """
+        with self._lock:
+            entry = self._memory.get(key) or self._load(key)
+            if entry is None:
+                return
+
+            entry = ({**entry[0], **fields}, entry[1], entry[2])
+            self._remember(key, entry)
+            self._store(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._connect().execute('DELETE FROM metadata')
+            self._connect().commit()
+
+    def _remember(self, key: str, entry: tuple):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            # file is shared by workers of sharded deployment,
+            # WAL lets them read while one of them writes
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                'key TEXT PRIMARY KEY, info TEXT, '
+                'resolved_at REAL, stream_resolved_at REAL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS metadata_resolved_at ON metadata (resolved_at)')
+            self._db.commit()
+
+        return self._db
+
+    def _load(self, key: str):
+        row = self._connect().execute(
+            'SELECT info, resolved_at, stream_resolved_at FROM metadata WHERE key = ?',
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        return json.loads(row[0]), row[1], row[2]
+
+    def _store(self, key: str, entry: tuple):
+        db = self._connect()
+        db.execute(
+            'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)',
+            (key, json.dumps(entry[0]), entry[1], entry[2]),
+        )
+        # drop expired rows once in a while to keep file small,
+        # first write of each process purges rows left by previous runs
+        if self._writes % PURGE_INTERVAL == 0:
+            db.execute(
+                'DELETE FROM metadata WHERE resolved_at < ?',
+                (time.time() - self.metadata_ttl,),
+            )
+        self._writes += 1
+        db.commit()
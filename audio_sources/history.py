@@ -0,0 +1,140 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+HISTORY_PATH = os.environ.get('AUDIO_STREAMER_HISTORY', 'history.sqlite3')
+# keyword searches matching previously resolved track are answered
+# by that track, without searching YouTube
+MATCH_HISTORY = True
+
+# weights of title, uploader and tags columns in ranking
+_RANK = 'bm25(tracks_fts, 10.0, 5.0, 1.0) * (1 + 0.1 * min(tracks.plays, 10))'
+
+
+class PlayHistory:
+    """
+    SQLite store of resolved tracks with FTS5 full-text index
+    over title, uploader and tags, ranked by relevance and play count.
+    """
+    def __init__(self, path: str = HISTORY_PATH):
+        self.path = path
+
+        self._db = None
+        self._lock = threading.Lock()
+
+    def record(self, info: dict, *, played: bool = False):
+        """
+        Stores (or updates) track of resolved `info`,
+        `played` also counts its playback.
+        """
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                'INSERT INTO tracks (url, title, uploader, tags, duration) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (url) DO UPDATE SET title = excluded.title, uploader = excluded.uploader, '
+                'tags = excluded.tags, duration = excluded.duration',
+                (info['webpage_url'], info.get('title'), info.get('uploader'),
+                 ' '.join(info.get('tags') or ()), info.get('duration')),
+            )
+            if played:
+                db.execute(
+                    'UPDATE tracks SET plays = plays + 1, last_played = ? WHERE url = ?',
+                    (time.time(), info['webpage_url']),
+                )
+            db.commit()
+
+    def match(self, search: str):
+        """
+        Returns url of the best track matching all keywords of `search` or `None`.
+        """
+        query = self._query(search, prefix=False)
+        if query is None:
+            return None
+
+        with self._lock:
+            row = self._connect().execute(
+                f'SELECT tracks.url FROM tracks_fts JOIN tracks ON tracks.id = tracks_fts.rowid '
+                f'WHERE tracks_fts MATCH ? ORDER BY {_RANK} LIMIT 1',
+                (query,),
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def search(self, search: str, *, limit: int = 10, offset: int = 0):
+        """
+        Returns `(total, rows)` of tracks matching keywords of `search`
+        (last one as prefix), rows are dicts ordered by rank.
+        """
+        query = self._query(search, prefix=True)
+        if query is None:
+            return 0, []
+
+        with self._lock:
+            db = self._connect()
+            total = db.execute(
+                'SELECT count(*) FROM tracks_fts WHERE tracks_fts MATCH ?',
+                (query,),
+            ).fetchone()[0]
+            rows = db.execute(
+                f'SELECT tracks.* FROM tracks_fts JOIN tracks ON tracks.id = tracks_fts.rowid '
+                f'WHERE tracks_fts MATCH ? ORDER BY {_RANK} LIMIT ? OFFSET ?',
+                (query, limit, offset),
+            ).fetchall()
+
+        return total, [dict(row) for row in rows]
+
+    def recent(self, *, limit: int = 10, offset: int = 0):
+        """
+        Returns `(total, rows)` of played tracks, the latest first.
+        """
+        with self._lock:
+            db = self._connect()
+            total = db.execute('SELECT count(*) FROM tracks WHERE last_played IS NOT NULL').fetchone()[0]
+            rows = db.execute(
+                'SELECT * FROM tracks WHERE last_played IS NOT NULL '
+                'ORDER BY last_played DESC LIMIT ? OFFSET ?',
+                (limit, offset),
+            ).fetchall()
+
+        return total, [dict(row) for row in rows]
+
+    @staticmethod
+    def _query(search: str, *, prefix: bool):
+        # keywords are quoted, so user input can't use FTS5 syntax
+        words = re.findall(r'\w+', search.lower())
+        if not words:
+            return None
+
+        query = ' '.join(f'"{word}"' for word in words)
+        return query + '*' if prefix else query
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.executescript(
+                'CREATE TABLE IF NOT EXISTS tracks ('
+                'id INTEGER PRIMARY KEY, url TEXT UNIQUE, title TEXT, uploader TEXT, tags TEXT, '
+                'duration INTEGER, plays INTEGER NOT NULL DEFAULT 0, last_played REAL);'
+                'CREATE INDEX IF NOT EXISTS tracks_last_played ON tracks (last_played);'
+                # index keeps no copy of text, it refers to `tracks` rows
+                'CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5('
+                "title, uploader, tags, content='tracks', content_rowid='id');"
+                'CREATE TRIGGER IF NOT EXISTS tracks_insert AFTER INSERT ON tracks BEGIN '
+                'INSERT INTO tracks_fts (rowid, title, uploader, tags) '
+                'VALUES (new.id, new.title, new.uploader, new.tags); END;'
+                'CREATE TRIGGER IF NOT EXISTS tracks_update AFTER UPDATE OF title, uploader, tags ON tracks BEGIN '
+                "INSERT INTO tracks_fts (tracks_fts, rowid, title, uploader, tags) "
+                "VALUES ('delete', old.id, old.title, old.uploader, old.tags); "
+                'INSERT INTO tracks_fts (rowid, title, uploader, tags) '
+                'VALUES (new.id, new.title, new.uploader, new.tags); END;'
+                'CREATE TRIGGER IF NOT EXISTS tracks_delete AFTER DELETE ON tracks BEGIN '
+                "INSERT INTO tracks_fts (tracks_fts, rowid, title, uploader, tags) "
+                "VALUES ('delete', old.id, old.title, old.uploader, old.tags); END;"
+            )
+
+        return self._db
@@ -0,0 +1,48 @@
+import threading
+import time
+
+
+WARM_UP = True  # load youtube-dl in background as soon as bot is connected
+# extractors prepared by warm-up, others are prepared on first use
+WARM_EXTRACTORS = ('Youtube', 'YoutubeSearch', 'YoutubeTab', 'YoutubePlaylist')
+
+timings = {}  # phase -> seconds, e.g. 'import' of youtube-dl
+
+_module = None
+_lock = threading.Lock()
+
+
+def load():
+    """
+    Returns `youtube_dl` module, importing it on first call.
+    Import of all extractors takes about a second, so it's
+    blocking and should be called from executor.
+    """
+    global _module
+    if _module is None:
+        with _lock:
+            if _module is None:
+                start = time.perf_counter()
+                import youtube_dl
+
+                # Silence useless bug reports messages
+                youtube_dl.utils.bug_reports_message = lambda: ''
+
+                timings['import'] = time.perf_counter() - start
+                _module = youtube_dl
+
+    return _module
+
+
+def prepare(ytdl, ie_keys: tuple = WARM_EXTRACTORS):
+    """
+    Instantiates given extractors of `ytdl` and compiles their url
+    patterns, which is otherwise done by first extraction.
+    """
+    for ie_key in ie_keys:
+        try:
+            extractor = ytdl.get_info_extractor(ie_key)
+        except KeyError:
+            # not available in installed youtube-dl version
+            continue
+        extractor.suitable('')
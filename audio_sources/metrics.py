@@ -0,0 +1,219 @@
+import asyncio
+import bisect
+import contextlib
+import os
+import threading
+import time
+
+import discord
+
+
+# metrics are collected only if they are exported
+# via HTTP endpoint (Prometheus text format) or file dumped periodically
+METRICS_PORT = int(os.environ.get('AUDIO_STREAMER_METRICS_PORT', 0))
+METRICS_FILE = os.environ.get('AUDIO_STREAMER_METRICS_FILE', '')
+METRICS_INTERVAL = 15  # seconds between file dumps
+
+enabled = bool(METRICS_PORT or METRICS_FILE)
+
+# upper bounds of latency histogram buckets, seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_gauges = {}  # name -> (help, callback returning value)
+_help = {}  # histogram name -> help
+_lock = threading.Lock()
+_null = contextlib.nullcontext()
+
+
+def observe(name: str, seconds: float, **labels):
+    """
+    Adds `seconds` to latency histogram `name` with given labels.
+    """
+    if not enabled:
+        return
+
+    key = (name, tuple(sorted(labels.items())))
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[index] += 1
+        histogram[-1] += seconds
+
+
+def timer(name: str, **labels):
+    """
+    Context manager observing its duration into histogram `name`.
+    """
+    if not enabled:
+        return _null
+
+    return _Timer(name, labels)
+
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+def describe(name: str, help: str):
+    _help[name] = help
+
+
+def gauge(name: str, help: str, callback):
+    """
+    Registers gauge which value is returned by `callback` at export time,
+    so it costs nothing between exports.
+    """
+    _gauges[name] = (help, callback)
+
+
+def render():
+    """
+    Returns all metrics in Prometheus text exposition format.
+    """
+    lines = []
+    for name, (help, callback) in sorted(_gauges.items()):
+        try:
+            value = callback()
+        except Exception:
+            continue
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+
+    with _lock:
+        histograms = sorted((key, list(value)) for key, value in _histograms.items())
+
+    described = set()
+    for (name, labels), histogram in histograms:
+        if name not in described:
+            described.add(name)
+            lines.append(f'# HELP {name} {_help.get(name, name)}')
+            lines.append(f'# TYPE {name} histogram')
+
+        labels = ','.join(f'{key}="{value}"' for key, value in labels)
+        separator = ',' if labels else ''
+        count = 0
+        for bound, bucket in zip(BUCKETS + ('+Inf',), histogram):
+            count += bucket
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {count}')
+        labels = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{labels} {histogram[-1]}')
+        lines.append(f'{name}_count{labels} {count}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def start(loop: asyncio.AbstractEventLoop):
+    """
+    Starts configured exporters, returns their tasks.
+    """
+    tasks = []
+    if METRICS_PORT:
+        tasks.append(loop.create_task(_serve(METRICS_PORT)))
+    if METRICS_FILE:
+        tasks.append(loop.create_task(_dump(METRICS_FILE)))
+
+    return tasks
+
+
+async def _serve(port: int):
+    async def respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # any request gets metrics, headers are read only to be polite
+            while (await reader.readline()).strip():
+                pass
+            body = render().encode()
+            writer.write(b'HTTP/1.0 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    # local only, should be scraped from the same machine
+    server = await asyncio.start_server(respond, '127.0.0.1', port)
+    async with server:
+        await server.serve_forever()
+
+
+async def _dump(path: str):
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        content = render()
+        await asyncio.get_event_loop().run_in_executor(None, _write, path, content)
+
+
+def _write(path: str, content: str):
+    # readers never see half-written file
+    with open(f'{path}.tmp', 'w') as file:
+        file.write(content)
+    os.replace(f'{path}.tmp', path)
+
+
+class TimedSource(discord.AudioSource):
+    """
+    Passes frames of `original` through, observing time from creation
+    to the first frame of given `stage` (e.g. FFmpeg spawn or start
+    of playback) and, if `jitter` is set, delay between consecutive reads.
+    Counts live sources per stage.
+    """
+    live = {}  # stage -> number of sources not cleaned up yet
+
+    def __init__(self, original: discord.AudioSource, *, stage: str, jitter: bool = False,
+                 requested_at: float = None):
+        self.original = original
+        self.stage = stage
+        self.jitter = jitter
+        self.requested_at = requested_at
+
+        self._created_at = time.perf_counter()
+        self._last_read = None
+        self._closed = False
+        self.live[stage] = self.live.get(stage, 0) + 1
+
+    def read(self):
+        frame = self.original.read()
+        now = time.perf_counter()
+
+        if self._last_read is None:
+            observe('first_frame_seconds', now - self._created_at, stage=self.stage)
+            if self.requested_at is not None:
+                observe('first_audio_seconds', now - self.requested_at)
+        elif self.jitter:
+            observe('frame_delay_seconds', max(now - self._last_read - 0.02, 0.0), stage=self.stage)
+        self._last_read = now
+
+        return frame
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        if not self._closed:
+            self._closed = True
+            self.live[self.stage] -= 1
+        self.original.cleanup()
+
+
+describe('resolve_seconds', 'Resolution of search or url by phase')
+describe('extract_info_seconds', 'youtube-dl extract_info call including wait for worker')
+describe('prepare_seconds', 'Preparation of song taken from queue until it can be played')
+describe('discord_api_seconds', 'Discord API calls made by notifications')
+describe('command_seconds', 'Bot command handling')
+describe('first_frame_seconds', 'Time to the first frame: from FFmpeg spawn or from start of playback')
+describe('first_audio_seconds', 'Time from play command to its first frame handed to voice client')
+describe('frame_delay_seconds', 'Delay of frame delivery beyond 20 ms after previous one')
+gauge('ffmpeg_processes', 'Live FFmpeg playback processes', lambda: TimedSource.live.get('ffmpeg', 0))
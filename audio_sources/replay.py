@@ -0,0 +1,110 @@
+import discord
+
+
+REPLAY_BUFFER_SIZE = 0  # bytes of PCM frames recorded per track, 0 disables recording
+# REPLAY_BUFFER_SIZE = 64 * 1024 ** 2  # 64 MiB, ~6 min of PCM audio
+
+
+class FrameRecorder(discord.AudioSource):
+    """
+    Passes frames of `original` source through,
+    keeping copy of them while they fit into `limit` bytes.
+    """
+    def __init__(self, original: discord.AudioSource, limit: int):
+        self.original = original
+        self.limit = limit
+
+        self._frames = []
+        self._size = 0
+        self._overflow = False
+        self._complete = False
+
+    @property
+    def overflow(self):
+        return self._overflow
+
+    @property
+    def size(self):
+        """
+        Bytes of frames held in memory.
+        """
+        return self._size if not self._overflow else 0
+
+    @property
+    def frames(self):
+        """
+        Recorded frames of whole track or `None` if track
+        wasn't played till the end or didn't fit into limit.
+        """
+        if self._complete and not self._overflow:
+            return tuple(self._frames)
+
+        return None
+
+    def read(self):
+        frame = self.original.read()
+
+        if not frame:
+            self._complete = True
+        elif not self._overflow:
+            self._size += len(frame)
+            if self._size > self.limit:
+                # track is too long, free memory right away
+                self._overflow = True
+                self._frames = []
+            else:
+                self._frames.append(frame)
+
+        return frame
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+class ReplaySource(discord.AudioSource):
+    """
+    Plays previously recorded frames from memory.
+    """
+    def __init__(self, frames: tuple):
+        self._frames = frames
+        self._index = 0
+
+    def read(self):
+        if self._index >= len(self._frames):
+            return b''
+
+        frame = self._frames[self._index]
+        self._index += 1
+        return frame
+
+    def is_opus(self):
+        return False
+
+
+class PeekedSource(discord.AudioSource):
+    """
+    Reads first frame of `original` source in advance to check if
+    it's playable, without losing that frame.
+    """
+    def __init__(self, original: discord.AudioSource):
+        self.original = original
+        # if FFmpegPCMAudio fails to read source (e.g. file is missing or
+        # failed to connect to server), .read() returns b''
+        self._first = original.read()
+        self.empty = not self._first
+
+    def read(self):
+        if self._first is not None:
+            frame, self._first = self._first, None
+            return frame
+
+        return self.original.read()
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.original.cleanup()
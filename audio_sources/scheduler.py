@@ -0,0 +1,177 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# 'thread' runs lookups in threads of bot process,
+# 'process' runs them in worker processes (see `workers.py`)
+# to keep youtube-dl off the GIL of voice send loop
+LOOKUP_BACKEND = os.environ.get('AUDIO_STREAMER_EXTRACTION', 'thread')
+LOOKUP_WORKERS = 4  # threads/processes for metadata lookups (search, extract_info)
+DOWNLOAD_WORKERS = 2  # threads for file downloads (`loop`)
+PLAYLIST_WORKERS = 1  # threads for paging through playlists
+PER_GUILD_JOBS = 2  # max concurrent jobs of one guild in each pool
+
+
+class _Pool:
+    """
+    Executor with per-guild queues which are served round-robin,
+    so one guild can't occupy all workers.
+    """
+    def __init__(self, name: str, workers: int, per_guild: int,
+                 *, executor=None):
+        self.name = name
+        self.workers = workers
+        self.per_guild = per_guild
+        self.executor = executor or ThreadPoolExecutor(max_workers=workers,
+                                                       thread_name_prefix=f'extract-{name}')
+
+        self._pending = {}  # guild_id -> deque of jobs
+        self._active = {}  # guild_id -> number of running jobs
+        self._order = deque()  # round-robin order of guilds with pending jobs
+        self._running = 0
+
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def depth(self):
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    @property
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'running': self._running,
+            'queued': self.depth,
+            'completed': self.completed,
+            'avg_wait': self.wait_total / self.completed if self.completed else 0.0,
+            'max_wait': self.wait_max,
+        }
+
+    def submit(self, loop: asyncio.AbstractEventLoop, guild_id: int,
+               future: asyncio.Future, func, args: tuple):
+        if guild_id not in self._pending:
+            self._pending[guild_id] = deque()
+            self._order.append(guild_id)
+        self._pending[guild_id].append((future, func, args, time.perf_counter()))
+
+        self._dispatch(loop)
+
+    def _dispatch(self, loop: asyncio.AbstractEventLoop):
+        # every guild in `_order` is visited at most once per pass, guilds
+        # which reached `per_guild` limit are moved to the end of the line
+        skipped = 0
+        while self._running < self.workers and skipped < len(self._order):
+            guild_id = self._order[0]
+            self._order.rotate(-1)
+
+            if self._active.get(guild_id, 0) >= self.per_guild:
+                skipped += 1
+                continue
+
+            jobs = self._pending[guild_id]
+            future, func, args, enqueued_at = jobs.popleft()
+            if not jobs:
+                del self._pending[guild_id]
+                self._order.remove(guild_id)
+
+            # caller went away (e.g. command was cancelled)
+            if future.cancelled():
+                continue
+
+            skipped = 0
+            wait = time.perf_counter() - enqueued_at
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+            self._running += 1
+            self._active[guild_id] = self._active.get(guild_id, 0) + 1
+
+            job = loop.run_in_executor(self.executor, func, *args)
+            job.add_done_callback(
+                lambda job, guild_id=guild_id, future=future: self._done(loop, guild_id, future, job)
+            )
+
+    def _done(self, loop: asyncio.AbstractEventLoop, guild_id: int,
+              future: asyncio.Future, job: asyncio.Future):
+        self._running -= 1
+        self._active[guild_id] -= 1
+        if not self._active[guild_id]:
+            del self._active[guild_id]
+        self.completed += 1
+
+        if job.cancelled():
+            future.cancel()
+        elif not future.cancelled():
+            if job.exception() is not None:
+                future.set_exception(job.exception())
+            else:
+                future.set_result(job.result())
+
+        self._dispatch(loop)
+
+
+class ExtractionScheduler:
+    """
+    Runs blocking youtube-dl calls in dedicated thread pools:
+    `lookup` for metadata extraction, `download` for file downloads
+    and `playlist` for paging through playlists, so short lookups
+    never wait behind long downloads or huge playlists.
+    Jobs of different guilds are served round-robin.
+    """
+    def __init__(self, *, lookup_workers: int = LOOKUP_WORKERS,
+                 download_workers: int = DOWNLOAD_WORKERS,
+                 playlist_workers: int = PLAYLIST_WORKERS,
+                 per_guild: int = PER_GUILD_JOBS,
+                 backend: str = LOOKUP_BACKEND, ytdl_options: dict = None):
+        if backend not in ('thread', 'process'):
+            raise ValueError(f'Unknown extraction backend `{backend}`')
+        self.backend = backend
+
+        lookup_executor = None
+        if backend == 'process':
+            from . import workers
+
+            # `fork` of process with running event loop and threads is unsafe
+            lookup_executor = ProcessPoolExecutor(
+                max_workers=lookup_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=workers.init_worker,
+                initargs=(ytdl_options or {},),
+            )
+
+        self.pools = {
+            'lookup': _Pool('lookup', lookup_workers, per_guild, executor=lookup_executor),
+            'download': _Pool('download', download_workers, per_guild),
+            # playlist entries are lazy generators which can't leave
+            # bot process, so this pool always uses threads
+            'playlist': _Pool('playlist', playlist_workers, per_guild),
+        }
+
+    @property
+    def stats(self):
+        return {name: pool.stats for name, pool in self.pools.items()}
+
+    @property
+    def in_processes(self):
+        return self.backend == 'process'
+
+    async def run(self, pool: str, guild_id: int, func, *args):
+        """
+        Schedules `func(*args)` in given pool on behalf of `guild_id`
+        and waits for result.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.pools[pool].submit(loop, guild_id, future, func, args)
+
+        return await future
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.executor.shutdown(wait=False)
@@ -0,0 +1,176 @@
+import json
+import re
+import subprocess
+
+import discord
+
+try:
+    import numpy
+except ImportError:
+    import audioop
+    numpy = None
+
+
+# 'off' disables loudness normalization, 'download' measures loudness
+# of downloaded files, 'background' also measures streamed songs
+# (this fetches stream second time)
+MEASURE_LOUDNESS = 'download'
+LOUDNESS_TARGET = -16.0  # LUFS
+MAX_LOUDNESS_GAIN = 4.0  # +12 dB
+
+
+def loudness_gain(loudness: float = None):
+    """
+    Returns multiplier which brings track with given integrated
+    loudness (LUFS) to `LOUDNESS_TARGET`.
+    """
+    if loudness is None or MEASURE_LOUDNESS == 'off':
+        return 1.0
+
+    gain = 10 ** ((LOUDNESS_TARGET - loudness) / 20)
+    return min(max(gain, 1 / MAX_LOUDNESS_GAIN), MAX_LOUDNESS_GAIN)
+
+
+def measure_loudness(source: str, *, before_options: str = ''):
+    """
+    Decodes whole `source` with FFmpeg `loudnorm` filter and returns
+    its integrated loudness (LUFS) or `None`. Blocking, takes about
+    as long as decoding of the track, should be called from executor.
+    """
+    args = ['ffmpeg', '-hide_banner', '-nostats']
+    args.extend(before_options.split())
+    args.extend(['-i', source, '-vn', '-af', 'loudnorm=print_format=json', '-f', 'null', '-'])
+
+    try:
+        result = subprocess.run(args, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    # JSON report is the last thing printed by the filter
+    report = re.search(r'\{[^{}]*"input_i"[^{}]*\}', result.stderr.decode(errors='ignore'))
+    if report is None:
+        return None
+
+    loudness = float(json.loads(report.group(0))['input_i'])
+    # silence is reported as -inf
+    return loudness if loudness > -70 else None
+
+
+def _mix(frame: bytes, other: bytes, weight: float):
+    """
+    Returns `frame * (1 - weight) + other * weight`.
+    """
+    if numpy is None:
+        return audioop.add(audioop.mul(frame, 2, 1 - weight), audioop.mul(other, 2, weight), 2)
+
+    mixed = (numpy.frombuffer(frame, dtype=numpy.int16) * numpy.float32(1 - weight)
+             + numpy.frombuffer(other, dtype=numpy.int16) * numpy.float32(weight))
+    return mixed.astype(numpy.int16).tobytes()
+
+
+class VolumeTransformer(discord.PCMVolumeTransformer):
+    """
+    PCMVolumeTransformer which also applies per-track loudness `gain`
+    and ramps volume changes over `RAMP_FRAMES` frames to avoid clicks.
+    It can also crossfade into next source at the end of track.
+
+    Frames are processed as NumPy int16 arrays in preallocated buffers,
+    `audioop` is used if NumPy is not installed.
+    """
+    RAMP_FRAMES = 5  # 100 ms
+    FRAME_LENGTH = 0.02  # 20 ms
+
+    gain = 1.0
+
+    def __init__(self, original: discord.AudioSource, volume: float = 1.0):
+        super().__init__(original, volume)
+
+        self._current = None  # multiplier applied to last frame
+        self._ramp_target = None
+        self._ramp_left = 0
+        self._samples = 0
+        self._limit_peak = None  # multiplier `_limits` of samples were computed for
+        self._limits = None
+
+        self.frames = 0  # frames played so far
+        self._next = None  # source mixed in at the end of track
+        self._fade_at = 0
+        self._fade_frames = 0
+
+    @property
+    def elapsed(self):
+        return self.frames * self.FRAME_LENGTH
+
+    def crossfade(self, source: discord.AudioSource = None, *, at: int = 0, frames: int = 0):
+        """
+        Mixes `source` in, starting from frame `at` over `frames` frames.
+        Frames mixed in are consumed from `source`, so it should be played
+        next to continue where crossfade ended. `None` cancels crossfade.
+        """
+        self._next = source
+        self._fade_at = at
+        self._fade_frames = max(frames, 1)
+
+    def read(self):
+        frame = self._transform()
+        self.frames += 1
+
+        if frame and self._next is not None and self.frames > self._fade_at:
+            other = self._next.read()
+            if len(other) == len(frame):
+                weight = min((self.frames - self._fade_at) / self._fade_frames, 1.0)
+                frame = _mix(frame, other, weight)
+
+        return frame
+
+    def _transform(self):
+        frame = self.original.read()
+        if not frame:
+            return frame
+
+        target = min(self._volume, 2.0) * self.gain
+        if self._current is None:
+            self._current = self._ramp_target = target
+
+        if numpy is None:
+            self._current = target
+            return audioop.mul(frame, 2, target)
+
+        samples = numpy.frombuffer(frame, dtype=numpy.int16)
+        if len(samples) != self._samples:
+            # last frame of track might be shorter
+            self._samples = len(samples)
+            self._float = numpy.empty(self._samples, dtype=numpy.float32)
+            self._out = numpy.empty(self._samples, dtype=numpy.int16)
+
+        if target != self._ramp_target:
+            self._ramp_target = target
+            self._ramp_left = self.RAMP_FRAMES
+
+        # int16 samples can't overflow unless they are amplified, then
+        # they are limited before multiplication, which is cheaper than
+        # clipping floats afterwards
+        peak = max(self._current, target) if self._ramp_left else target
+        if peak > 1.0:
+            if peak != self._limit_peak:
+                limit = int(32767 / peak)
+                self._limit_peak = peak
+                self._limits = numpy.int16(-limit), numpy.int16(limit)
+            samples.clip(*self._limits, out=self._out)
+            samples = self._out
+
+        if self._ramp_left:
+            end = self._current + (target - self._current) / self._ramp_left
+            self._ramp_left -= 1
+            # same multiplier for both channels of each sample
+            ramp = numpy.linspace(self._current, end, (self._samples + 1) // 2,
+                                  dtype=numpy.float32).repeat(2)[:self._samples]
+            numpy.multiply(samples, ramp, out=self._float)
+            self._current = end
+        else:
+            numpy.multiply(samples, numpy.float32(target), out=self._float)
+
+        numpy.copyto(self._out, self._float, casting='unsafe')
+
+        return self._out.tobytes()
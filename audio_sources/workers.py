@@ -0,0 +1,45 @@
+from . import loader
+from .cache import DROPPED_FIELDS
+from .errors import YTDLError
+
+
+_ytdl = None
+
+
+def init_worker(options: dict):
+    """
+    Process pool initializer: each worker keeps its own
+    warm `YoutubeDL` instance for all extractions.
+    """
+    global _ytdl
+    _ytdl = loader.load().YoutubeDL(options)
+    loader.prepare(_ytdl)
+
+
+def extract_info(url: str, *, process: bool = True):
+    """
+    Runs `extract_info()` in worker and returns plain picklable dict.
+    """
+    try:
+        info = _ytdl.extract_info(url, download=False, process=process)
+    except loader.load().utils.DownloadError as e:
+        # traceback kept in `exc_info` can't be pickled back to bot process
+        raise YTDLError(str(e))
+    if info is None:
+        return None
+
+    if 'entries' in info:
+        # flat results might hold generators which can't be pickled,
+        # only first suitable entry is used anyway
+        entry = next((entry for entry in info['entries'] if entry), None)
+        info['entries'] = [entry] if entry else []
+
+    return _strip(info)
+
+
+def _strip(info: dict):
+    info = {k: v for k, v in info.items() if k not in DROPPED_FIELDS}
+    if info.get('entries'):
+        info['entries'] = [_strip(entry) for entry in info['entries']]
+
+    return info
@@ -1,19 +1,40 @@
 import asyncio
 import functools
+import itertools
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlparse
 
 import discord
-import youtube_dl
 
 from discord.ext import commands
 
+from . import loader, metrics, workers
+from .audio_cache import AudioCache
+from .buffering import READ_AHEAD_MS, PrebufferedSource, ReadAheadSource
+from .cache import MetadataCache
+from .errors import YTDLError
+from .history import MATCH_HISTORY, PlayHistory
+from .replay import FrameRecorder, PeekedSource
+from .scheduler import ExtractionScheduler
+from .volume import MEASURE_LOUDNESS, VolumeTransformer, loudness_gain, measure_loudness
 
-# Silence useless bug reports messages
-youtube_dl.utils.bug_reports_message = lambda: ''
 
+# 'pcm' decodes audio to PCM and applies volume in Python,
+# 'opus' makes FFmpeg output Opus packets (see `YTDLOpusSource`)
+AUDIO_MODE = os.environ.get('AUDIO_STREAMER_AUDIO_MODE', 'pcm')
 
-class YTDLSource(discord.PCMVolumeTransformer):
+# second path segments of SoundCloud links which aren't tracks
+_SOUNDCLOUD_COLLECTIONS = ('sets', 'tracks', 'albums', 'popular-tracks', 'likes', 'reposts',
+                           'followers', 'following', 'comments', 'spotlight')
+
+
+class YTDLSource(VolumeTransformer):
     YTDL_OPTIONS = {
-        'format': 'bestaudio/best',
+        'format': 'bestaudio[acodec=opus]/bestaudio/best' if AUDIO_MODE == 'opus' else 'bestaudio/best',
         'extractaudio': True,
         'audioformat': 'mp3',
         'outtmpl': 'audio.mp3',
@@ -33,12 +54,32 @@ class YTDLSource(discord.PCMVolumeTransformer):
         'options': '-vn',
     }
 
-    ytdl = youtube_dl.YoutubeDL(YTDL_OPTIONS)
+    # 'auto' resolves direct video links with single processed extraction
+    # and uses two-phase (flat search + processing) flow for everything else,
+    # 'two-phase' always uses two-phase flow
+    RESOLVE_MODE = 'auto'
+
+    PLAYLIST_BATCH = 10  # playlist entries fetched at once
+
+    ytdl = None  # YoutubeDL, created on first use by `get_ytdl()`
+    _ytdl_lock = threading.Lock()
+    cache = MetadataCache()
+    history = PlayHistory()
+    audio_cache = AudioCache()
+    scheduler = ExtractionScheduler(ytdl_options=YTDL_OPTIONS)
+    timings = {}
+    _resolving = {}  # (normalized search, fresh) -> task shared by concurrent resolutions
+    coalesced = 0  # resolutions which joined one already in progress
+
+    buffer = None  # PrebufferedSource, if source can be warmed up
+    read_ahead = None  # ReadAheadSource, if enabled
 
     def __init__(self, ctx: commands.Context, source: discord.FFmpegPCMAudio,
                  *, data: dict, volume: float = 0.5):
         super().__init__(source, volume)
+        self._set_data(ctx, data)
 
+    def _set_data(self, ctx: commands.Context, data: dict):
         self.requester = ctx.author
         self.channel = ctx.channel
         self.data = data
@@ -46,14 +87,17 @@ class YTDLSource(discord.PCMVolumeTransformer):
         self.uploader = data.get('uploader')
         self.uploader_url = data.get('uploader_url')
         date = data.get('upload_date')
-        self.upload_date = date[6:8] + '.' + date[4:6] + '.' + date[0:4]
+        self.upload_date = date[6:8] + '.' + date[4:6] + '.' + date[0:4] if date else None
         self.title = data.get('title')
         self.thumbnail = data.get('thumbnail')
         self.description = data.get('description')
-        self.duration = self._parse_duration(int(data.get('duration')))
+        duration = data.get('duration')
+        # live streams have no duration
+        self.duration = self._parse_duration(int(duration)) if duration else 'Unknown'
         self.tags = data.get('tags')
         self.url = data.get('webpage_url')
         self.stream_url = data.get('url')
+        self.gain = loudness_gain(data.get('loudness'))
 
     def __str__(self):
         return f'**{self.title}** by **{self.uploader}**'
@@ -62,18 +106,132 @@ class YTDLSource(discord.PCMVolumeTransformer):
     async def create_source(cls, ctx: commands.Context, search: str,
                             *, loop: asyncio.BaseEventLoop = None,
                             download: bool = False, volume: float = 0.5):
+        info = await cls.resolve_info(search, guild_id=ctx.guild.id, loop=loop)
+
+        return cls.from_info(ctx, info, volume=volume)
+
+    @classmethod
+    def from_info(cls, ctx: commands.Context, info: dict,
+                  *, volume: float = 0.5, path: str = None,
+                  record: int = 0, probe: bool = False, prebuffer: bool = False):
+        """
+        Creates source from resolved `info`, playing downloaded
+        file at `path` instead of stream if provided.
+        If `record` is set, up to `record` bytes of frames are kept
+        in memory for replay.
+        If `probe` is set, first frame is read in advance to make sure
+        source is playable.
+        If `prebuffer` is set, source gets `buffer` which can be filled
+        in advance (see `PrebufferedSource`).
+        """
+        if AUDIO_MODE == 'opus':
+            # recorded Opus packets would keep volume they were recorded
+            # with, so replay from memory is not available in this mode
+            return YTDLOpusSource(ctx, path or info['url'], data=info,
+                                  volume=volume, stream=path is None,
+                                  probe=probe, prebuffer=prebuffer)
+
+        if path is not None:
+            source = discord.FFmpegPCMAudio(path, options='-vn')
+        else:
+            source = discord.FFmpegPCMAudio(info['url'], **cls.FFMPEG_OPTIONS)
+        if metrics.enabled:
+            source = metrics.TimedSource(source, stage='ffmpeg')
+
+        read_ahead = None
+        if READ_AHEAD_MS:
+            source = read_ahead = ReadAheadSource(source)
+
+        if probe:
+            source = PeekedSource(source)
+            if source.empty:
+                source.cleanup()
+                raise YTDLError(f'Couldn\'t read `{info.get("webpage_url")}`')
+
+        buffer = None
+        if prebuffer:
+            source = buffer = PrebufferedSource(source)
+
+        if record:
+            source = FrameRecorder(source, record)
+
+        source = cls(ctx, source, data=info, volume=volume)
+        source.buffer = buffer
+        source.read_ahead = read_ahead
+        return source
+
+    @classmethod
+    async def resolve_info(cls, search: str, *, guild_id: int,
+                           loop: asyncio.BaseEventLoop = None, fresh: bool = False):
+        """
+        Resolves `search` into youtube-dl `info` dict, using cache if possible.
+        `fresh` forces re-resolution of stream url (e.g. when it's about to expire).
+        """
         loop = loop or asyncio.get_event_loop()
 
-        # create a callable `partial()` which acts like `ytdl.extract_info()`
-        # but requires less arguments as `serach`, `download` and `process`
-        # are pre-defined
-        partial = functools.partial(
-            cls.ytdl.extract_info,
-            search,
-            download=False,
-            process=False,
-        )
-        data = await loop.run_in_executor(None, partial)
+        # the same link played by many guilds at once is extracted once,
+        # each of them creates its own source from shared info
+        key = (cls.cache.normalize(search), fresh)
+        task = cls._resolving.get(key)
+        if task is None:
+            task = loop.create_task(cls._resolve_info(search, guild_id=guild_id, loop=loop, fresh=fresh))
+            cls._resolving[key] = task
+            task.add_done_callback(functools.partial(cls._resolved, key))
+        else:
+            cls.coalesced += 1
+
+        # cancelled caller (e.g. song removed from queue) leaves it to others
+        return await asyncio.shield(task)
+
+    @classmethod
+    def _resolved(cls, key: tuple, task: asyncio.Task):
+        if cls._resolving.get(key) is task:
+            del cls._resolving[key]
+        # error might be left unretrieved if all callers were cancelled
+        task.cancelled() or task.exception()
+
+    @classmethod
+    async def _resolve_info(cls, search: str, *, guild_id: int,
+                            loop: asyncio.BaseEventLoop, fresh: bool):
+        key = cls.cache.normalize(search)
+        cached = await loop.run_in_executor(None, cls.cache.get, key)
+
+        if cached is None and MATCH_HISTORY and not re.match(r'^https?://', search.strip()):
+            # keywords of previously resolved track are resolved by its url,
+            # which is usually cached, instead of searching
+            with cls._timed('history'):
+                url = await loop.run_in_executor(None, cls.history.match, search)
+            if url is not None:
+                return await cls.resolve_info(url, guild_id=guild_id, loop=loop, fresh=fresh)
+
+        if cached is None:
+            info = await cls._resolve(search, guild_id=guild_id)
+        elif (fresh or not cached[1]) and not cls.audio_cache.contains(cached[0]):
+            # metadata is still valid, only stream url expired,
+            # downloaded track is played without it
+            info = await cls._process(cached[0]['webpage_url'], guild_id=guild_id)
+        else:
+            return cached[0]
+
+        return await loop.run_in_executor(None, cls._remember, key, info)
+
+    @classmethod
+    def _remember(cls, key: str, info: dict):
+        info = cls.cache.put(key, info)
+        # direct links to the same video should hit cache too
+        cls.cache.put(cls.cache.normalize(info['webpage_url']), info)
+        cls.history.record(info)
+
+        return info
+
+    @classmethod
+    async def _resolve(cls, search: str, *, guild_id: int):
+        if cls.RESOLVE_MODE == 'auto' and cls._is_direct_url(search):
+            with cls._timed('single'):
+                return await cls._process(search, guild_id=guild_id)
+
+        with cls._timed('search'):
+            data = await cls._extract_info(search, guild_id=guild_id, process=False)
 
         if data is None:
             raise YTDLError(f'Couldn\'t find anything that matches `{search}`')
@@ -90,13 +248,12 @@ class YTDLSource(discord.PCMVolumeTransformer):
             if process_info is None:
                 raise YTDLError(f'Couldn\'t find anything that matches `{search}`')
 
-        webpage_url = process_info['webpage_url']
-        partial = functools.partial(
-            cls.ytdl.extract_info,
-            webpage_url,
-            download=False,
-        )
-        processed_info = await loop.run_in_executor(None, partial)
+        with cls._timed('process'):
+            return await cls._process(process_info['webpage_url'], guild_id=guild_id)
+
+    @classmethod
+    async def _process(cls, webpage_url: str, *, guild_id: int):
+        processed_info = await cls._extract_info(webpage_url, guild_id=guild_id)
 
         if processed_info is None:
             raise YTDLError(f'Couldn\'t fetch `{webpage_url}`')
@@ -111,31 +268,239 @@ class YTDLSource(discord.PCMVolumeTransformer):
                 except IndexError:
                     raise YTDLError(f'Couldn\'t retrieve any matches for `{webpage_url}`')
 
-        return cls(
-            ctx,
-            discord.FFmpegPCMAudio(info['url'], **cls.FFMPEG_OPTIONS),
-            data=info,
-            volume=volume,
+        return info
+
+    @classmethod
+    async def _extract_info(cls, url: str, *, guild_id: int, process: bool = True):
+        if cls.scheduler.in_processes:
+            # worker process uses its own `YoutubeDL` instance
+            partial = functools.partial(
+                workers.extract_info,
+                url,
+                process=process,
+            )
+        else:
+            # create a callable `partial()` which acts like `ytdl.extract_info()`
+            # but requires less arguments as `serach`, `download` and `process`
+            # are pre-defined
+            partial = functools.partial(
+                cls._ytdl_extract_info,
+                url,
+                process=process,
+            )
+
+        with metrics.timer('extract_info_seconds', process=str(process).lower()):
+            return await cls.scheduler.run('lookup', guild_id, partial)
+
+    @classmethod
+    async def iter_playlist(cls, url: str, *, guild_id: int):
+        """
+        Asynchronously yields lists of playlist entry urls.
+        First batch has single entry, so it can be played right away,
+        the rest is fetched in batches of `PLAYLIST_BATCH` on demand.
+        """
+        partial = functools.partial(
+            cls._ytdl_extract_info,
+            url,
+            process=False,
         )
+        data = await cls.scheduler.run('playlist', guild_id, partial)
+
+        if data is None or 'entries' not in data:
+            raise YTDLError(f'Couldn\'t fetch playlist `{url}`')
+
+        # flat extraction returns lazy generator which pages
+        # through playlist only when it's iterated
+        entries = iter(data['entries'])
+        size = 1
+        while True:
+            partial = functools.partial(
+                cls._take,
+                entries,
+                size,
+            )
+            batch = await cls.scheduler.run('playlist', guild_id, partial)
+            if not batch:
+                return
+
+            yield [cls._entry_url(entry) for entry in batch if entry]
+            size = cls.PLAYLIST_BATCH
 
     @classmethod
-    async def download(cls, filename: str, url: str,
-                       loop: asyncio.BaseEventLoop = None):
+    async def download(cls, info: dict, *, guild_id: int = None):
+        """
+        Downloads audio of resolved `info` into audio cache
+        (unless it's already there) and returns path to file.
+        """
+        path = cls.audio_cache.lookup(info)
+        if path is not None:
+            return path
 
-        loop = loop or asyncio.get_event_loop()
+        partial = functools.partial(
+            cls.audio_cache.store,
+            info,
+            functools.partial(cls._download, info['url']),
+        )
+        try:
+            return await cls.scheduler.run('download', guild_id, partial)
+        except YTDLError:
+            raise YTDLError(f'Failed to download `{info.get("webpage_url")}`')
 
-        cls.ytdl.params['outtmpl'] = filename
+    @classmethod
+    async def analyze(cls, info: dict, *, guild_id: int = None, path: str = None,
+                      keys: tuple = ()):
+        """
+        Measures loudness of song (downloaded file at `path` or stream)
+        once and stores it in `info` and metadata cache under `keys`.
+        """
+        if MEASURE_LOUDNESS == 'off' or 'loudness' in info:
+            return
+        if path is None and MEASURE_LOUDNESS != 'background':
+            return
 
         partial = functools.partial(
-            cls.ytdl.download,
-            [url],
+            measure_loudness,
+            path or info['url'],
+            before_options='' if path else cls.FFMPEG_OPTIONS['before_options'],
         )
-        res = await loop.run_in_executor(None, partial)
+        loudness = await cls.scheduler.run('download', guild_id, partial)
+        if loudness is None:
+            return
+
+        info['loudness'] = loudness
+        for key in set(keys) | {cls.cache.normalize(info['webpage_url'])}:
+            await asyncio.get_event_loop().run_in_executor(
+                None,
+                functools.partial(cls.cache.annotate, key, loudness=loudness),
+            )
+
+    @classmethod
+    def _download(cls, url: str, filename: str):
+        youtube_dl = loader.load()
+        # `outtmpl` can't be changed on shared instance while
+        # other guilds are downloading, so each download has its own
+        ytdl = youtube_dl.YoutubeDL(dict(cls.YTDL_OPTIONS, outtmpl=filename))
+        try:
+            ytdl.download([url])
+        except youtube_dl.utils.DownloadError as e:
+            # youtube-dl might not be loaded where error is caught
+            raise YTDLError(str(e))
+
+    @classmethod
+    def get_ytdl(cls):
+        """
+        Returns shared `YoutubeDL`, importing youtube-dl on first call.
+        Blocking, should be called from executor.
+        """
+        if cls.ytdl is None:
+            with cls._ytdl_lock:
+                if cls.ytdl is None:
+                    cls.ytdl = loader.load().YoutubeDL(cls.YTDL_OPTIONS)
+
+        return cls.ytdl
+
+    @classmethod
+    def _ytdl_extract_info(cls, url: str, *, process: bool = True):
+        ytdl = cls.get_ytdl()
+        try:
+            return ytdl.extract_info(url, download=False, process=process)
+        except loader.load().utils.DownloadError as e:
+            # unavailable video, bad link, etc. are reported like other lookup errors
+            raise YTDLError(str(e))
 
-        if res is None:
-            raise YTDLError(f'Failed to download `{url}`')
+    @staticmethod
+    def _take(entries, size: int):
+        # lazy playlist pages are fetched while entries are taken
+        try:
+            return list(itertools.islice(entries, size))
+        except loader.load().utils.DownloadError as e:
+            raise YTDLError(str(e))
+
+    @classmethod
+    async def warm_up(cls):
+        """
+        Loads youtube-dl and prepares common extractors in background,
+        so the first request doesn't pay for it.
+        """
+        if 'warm_up' in loader.timings:
+            return
 
-        return res
+        def warm_up():
+            start = time.perf_counter()
+            loader.prepare(cls.get_ytdl())
+            loader.timings['warm_up'] = time.perf_counter() - start
+
+        await asyncio.get_event_loop().run_in_executor(None, warm_up)
+
+    @staticmethod
+    def is_playlist_url(search: str):
+        if not re.match(r'^https?://\S+$', search.strip()):
+            return False
+
+        url = urlparse(search.strip())
+        host = url.netloc.lower()
+        path = url.path.lower()
+
+        if host.endswith('youtube.com'):
+            return path == '/playlist' and 'list' in parse_qs(url.query)
+
+        return bool(re.search(r'/(playlist|sets|album)(/|$)', path))
+
+    @staticmethod
+    def _entry_url(entry: dict):
+        url = entry.get('webpage_url') or entry.get('url')
+        # flat YouTube entries hold only video id
+        if not url.startswith('http') and entry.get('ie_key') == 'Youtube':
+            url = f'https://www.youtube.com/watch?v={url}'
+
+        return url
+
+    @staticmethod
+    def _is_direct_url(search: str):
+        """
+        Guesses if `search` is a link to single video,
+        so it can be resolved with one processed extraction.
+        """
+        if not re.match(r'^https?://\S+$', search.strip()):
+            return False
+
+        url = urlparse(search.strip())
+        host = url.netloc.lower()
+        path = url.path.lower()
+
+        if host.endswith('youtu.be'):
+            return bool(path.strip('/'))
+        if host.endswith('youtube.com'):
+            return ((path == '/watch' and 'v' in parse_qs(url.query))
+                    or bool(re.match(r'^/(shorts|embed|live)/[^/]+/?$', path)))
+        if host.endswith('vimeo.com'):
+            return bool(re.match(r'^/\d+/?$', path))
+        if host.endswith('soundcloud.com'):
+            # `/artist/track`, but not artist's collections
+            match = re.match(r'^/[^/]+/([^/]+)/?$', path)
+            return match is not None and match.group(1) not in _SOUNDCLOUD_COLLECTIONS
+
+        # link of unknown shape might lead to a whole collection, which
+        # would be processed entry by entry, so it gets flat search first
+        return False
+
+    @classmethod
+    @contextmanager
+    def _timed(cls, phase: str):
+        """
+        Accumulates wall time of resolution phase into `timings`
+        as `[count, total seconds, last seconds]`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            timing = cls.timings.setdefault(phase, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = elapsed
+            metrics.observe('resolve_seconds', elapsed, phase=phase)
 
     @staticmethod
     def _parse_duration(duration: int):
@@ -156,5 +521,93 @@ class YTDLSource(discord.PCMVolumeTransformer):
         return ', '.join(duration)
 
 
-class YTDLError(Exception):
-    pass
+class YTDLOpusSource(YTDLSource):
+    """
+    YTDLSource which gets Opus packets straight from FFmpeg,
+    so neither PCM transform nor Opus encoding is done in bot process.
+
+    Opus streams are copied as is when volume is 100%, otherwise
+    volume is applied by FFmpeg filter and FFmpeg encodes audio.
+    Changing volume restarts FFmpeg at current position.
+    """
+    def __init__(self, ctx: commands.Context, source: str,
+                 *, data: dict, volume: float = 0.5,
+                 stream: bool = True, probe: bool = False, prebuffer: bool = False):
+        # PCMVolumeTransformer.__init__() is skipped
+        # as it accepts only PCM sources
+        self._set_data(ctx, data)
+        self._input = source
+        self._stream = stream
+        self._volume = max(volume, 0.0)
+        self.frames = 0
+        self._lock = threading.Lock()
+
+        self.original = self._spawn()
+        if probe:
+            self.original = PeekedSource(self.original)
+            if self.original.empty:
+                self.original.cleanup()
+                raise YTDLError(f'Couldn\'t read `{self.url}`')
+        if prebuffer:
+            self.original = self.buffer = PrebufferedSource(self.original)
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float):
+        value = max(value, 0.0)
+        if value == self._volume:
+            return
+
+        self._volume = value
+        # new process is spawned outside of lock,
+        # so voice send loop doesn't wait for it
+        original = self._spawn(offset=self.elapsed)
+        with self._lock:
+            self.original, original = original, self.original
+        original.cleanup()
+
+    def _spawn(self, offset: float = 0.0):
+        before_options = YTDLSource.FFMPEG_OPTIONS['before_options'] if self._stream else ''
+        if offset:
+            before_options += f' -ss {offset:.2f}'
+
+        volume = min(self._volume, 2.0) * self.gain
+        if volume == 1.0:
+            # FFmpegOpusAudio copies `opus` stream and encodes anything else
+            codec = self.data.get('acodec')
+            options = '-vn'
+        else:
+            codec = None
+            options = f'-vn -filter:a volume={volume:.3f}'
+
+        original = discord.FFmpegOpusAudio(
+            self._input,
+            codec=codec,
+            before_options=before_options,
+            options=options,
+        )
+        if metrics.enabled:
+            original = metrics.TimedSource(original, stage='ffmpeg')
+        if READ_AHEAD_MS:
+            original = self.read_ahead = ReadAheadSource(original)
+
+        return original
+
+    def read(self):
+        with self._lock:
+            packet = self.original.read()
+        if packet:
+            self.frames += 1
+
+        return packet
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        with self._lock:
+            self.original.cleanup()
+
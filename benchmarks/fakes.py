@@ -0,0 +1,199 @@
+"""
+Offline stand-ins for youtube-dl, Discord voice client and command
+context, so playback can be benchmarked without network and Discord.
+"""
+import itertools
+import os
+import re
+import subprocess
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+import discord
+
+
+FRAME_LENGTH = 0.02  # 20 ms
+
+
+def generate_tracks(directory: str, count: int, seconds: int):
+    """
+    Generates `count` Opus files of `seconds` length with FFmpeg,
+    returns their paths. Existing files are reused.
+    """
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f'track{index}-{seconds}s.ogg')
+        if not os.path.exists(path):
+            subprocess.run(
+                ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+                 '-f', 'lavfi', '-i', f'sine=frequency={220 * (index % 4 + 1)}:duration={seconds}',
+                 '-ac', '2', '-ar', '48000', '-c:a', 'libopus', '-b:a', '96k', path],
+                check=True,
+            )
+        paths.append(path)
+
+    return paths
+
+
+def track_url(index: int):
+    return f'https://www.youtube.com/watch?v=bench{index}'
+
+
+class FakeYoutubeDL:
+    """
+    Answers `extract_info()` with canned info dicts pointing to local
+    files, after `latency` seconds, like network round trip would take.
+    """
+    def __init__(self, paths: list, *, seconds: int, latency: float = 0.0):
+        self.paths = paths
+        self.seconds = seconds
+        self.latency = latency
+        self.calls = 0
+
+    def extract_info(self, url: str, download: bool = False, process: bool = True):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        match = re.search(r'v=bench(\d+)', url)
+        if match is None:
+            # keyword search: the same keywords always find the same track
+            index = zlib.crc32(url.encode()) % len(self.paths)
+            return {'entries': [self._info(index)]}
+
+        return self._info(int(match.group(1)) % len(self.paths))
+
+    def _info(self, index: int):
+        return {
+            'id': f'bench{index}',
+            'extractor': 'fake',
+            'format_id': 'opus',
+            'acodec': 'opus',
+            'webpage_url': track_url(index),
+            'url': self.paths[index],
+            'title': f'Benchmark track {index}',
+            'uploader': 'benchmarks',
+            'upload_date': '20200101',
+            'duration': self.seconds,
+            'tags': ['benchmark'],
+        }
+
+
+class FakeVoiceClient:
+    """
+    Plays sources the way `discord.VoiceClient` does: on separate thread,
+    reading one frame per 20 ms and calling `after` from that thread.
+    Records when each track was started and when its frames were read.
+    """
+    def __init__(self, *, encoder: discord.opus.Encoder = None):
+        self.encoder = encoder
+        self.tracks = []  # per played source: dict of timings
+        self.late_frames = 0  # frames read more than a frame late
+
+        self._thread = None
+        self._end = None
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def play(self, source: discord.AudioSource, *, after=None):
+        if self.is_playing():
+            raise discord.ClientException('Already playing audio.')
+
+        track = {'played_at': time.perf_counter(), 'first_frame': None, 'last_frame': None, 'frames': 0}
+        self.tracks.append(track)
+        self._end = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(source, after, track, self._end), daemon=True)
+        self._thread.start()
+
+    def is_playing(self):
+        # like `discord.player.AudioPlayer`: track is over once `_end` is set,
+        # even though its thread is still running `after`
+        return self._end is not None and not self._end.is_set() and self._resumed.is_set()
+
+    def is_paused(self):
+        return self._end is not None and not self._end.is_set() and not self._resumed.is_set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def stop(self):
+        if self._end is not None:
+            self._end.set()
+        self._resumed.set()
+
+    async def disconnect(self, *, force: bool = False):
+        self.stop()
+
+    async def move_to(self, channel):
+        pass
+
+    def _run(self, source: discord.AudioSource, after, track: dict, end: threading.Event):
+        start = time.perf_counter()
+        for loops in itertools.count(1):
+            if end.is_set():
+                break
+            self._resumed.wait()
+
+            data = source.read()
+            if not data:
+                break
+            if self.encoder is not None and not source.is_opus():
+                self.encoder.encode(data, self.encoder.SAMPLES_PER_FRAME)
+
+            now = time.perf_counter()
+            if track['first_frame'] is None:
+                track['first_frame'] = now
+            track['last_frame'] = now
+            track['frames'] += 1
+
+            delay = start + FRAME_LENGTH * loops - time.perf_counter()
+            if delay < -FRAME_LENGTH:
+                self.late_frames += 1
+            time.sleep(max(0.0, delay))
+
+        end.set()
+        source.cleanup()
+        if after is not None:
+            after(None)
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, channel: 'FakeChannel'):
+        self.id = next(self._ids)
+        self.channel = channel
+
+    async def edit(self, **fields):
+        pass
+
+    async def delete(self):
+        pass
+
+
+class FakeChannel:
+    def __init__(self):
+        self.last_message_id = None
+        self.sent = 0
+
+    async def send(self, content: str = None, *, embed: discord.Embed = None):
+        message = FakeMessage(self)
+        self.last_message_id = message.id
+        self.sent += 1
+        return message
+
+
+def fake_context(guild_id: int):
+    """
+    Minimal `commands.Context` used by `Voice`, `Song` and `YTDLSource`.
+    """
+    return SimpleNamespace(
+        guild=SimpleNamespace(id=guild_id, name=f'guild {guild_id}'),
+        author=SimpleNamespace(id=guild_id, name='benchmark', mention='@benchmark'),
+        channel=FakeChannel(),
+    )
@@ -0,0 +1,292 @@
+"""
+Offline benchmarks of playback and queue hot paths.
+
+youtube-dl is replaced by `FakeYoutubeDL` returning local files generated
+with FFmpeg, Discord voice client by `FakeVoiceClient` pulling frames
+at real-time pace. Measures:
+- queue operation costs at 10/1k/100k entries
+- decoded frames per CPU-second of bot process (FFmpeg runs separately)
+- time to first audio, gaps between tracks and late frames
+  of many simulated guilds playing at once
+
+Results are saved as JSON, two result files can be compared.
+
+Usage:
+    python -m benchmarks.suite [--guilds N] [--tracks N] [--seconds N] [--latency S]
+                               [--queue-only] [--output FILE]
+    python -m benchmarks.suite --compare OLD.json NEW.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import discord
+
+from audio_sources import youtube, volume
+from audio_sources.audio_cache import AudioCache
+from audio_sources.cache import MetadataCache
+from audio_sources.history import PlayHistory
+from audio_sources.youtube import YTDLSource
+from core.song import Song, SongQueue
+from core.voice import Voice
+from . import fakes
+
+
+QUEUE_SIZES = (10, 1000, 100000)
+QUEUE_REPEATS = 1000  # operations timed per queue size
+
+
+def _per_op(func, repeats: int = QUEUE_REPEATS):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func()
+
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def bench_queue(sizes: tuple = QUEUE_SIZES):
+    """
+    Microseconds per `SongQueue` operation at given queue sizes.
+    """
+    results = {}
+    for size in sizes:
+        queue = SongQueue()
+        start = time.perf_counter()
+        for index in range(size):
+            queue.put_nowait(Song(query=f'song {index}'))
+        put = (time.perf_counter() - start) / size * 1e6
+
+        middle = size // 2
+        page = middle // SongQueue.ITEMS_PER_PAGE + 1
+
+        def render():
+            queue.touch()
+            queue.create_embed(page)
+
+        def cycle():
+            # keeps queue size constant
+            queue.put_nowait(queue.get_nowait())
+
+        results[str(size)] = {
+            'put': put,
+            'get+put': _per_op(cycle),
+            'getitem': _per_op(lambda: queue[middle]),
+            'insert': _per_op(lambda: queue.insert(middle, queue[0])),
+            'remove': _per_op(lambda: queue.remove(middle)),
+            'move': _per_op(lambda: queue.move(0, middle)),
+            'page': _per_op(render),
+            'shuffle': _per_op(queue.shuffle, repeats=max(QUEUE_REPEATS * 10 // size, 1)),
+        }
+
+    return results
+
+
+def bench_decode(info: dict, ctx):
+    """
+    Reads whole track as fast as possible in each audio mode,
+    reports frames per CPU-second of this process.
+    """
+    modes = {
+        'pcm': {'AUDIO_MODE': 'pcm', 'READ_AHEAD_MS': 0},
+        'pcm+read_ahead': {'AUDIO_MODE': 'pcm', 'READ_AHEAD_MS': 200},
+        'opus': {'AUDIO_MODE': 'opus', 'READ_AHEAD_MS': 0},
+    }
+    results = {}
+    for name, settings in modes.items():
+        saved = {key: getattr(youtube, key) for key in settings}
+        for key, value in settings.items():
+            setattr(youtube, key, value)
+        try:
+            source = YTDLSource.from_info(ctx, info, volume=0.5)
+            frames = 0
+            start, cpu = time.perf_counter(), time.process_time()
+            while source.read():
+                frames += 1
+            wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+            source.cleanup()
+        finally:
+            for key, value in saved.items():
+                setattr(youtube, key, value)
+
+        results[name] = {
+            'frames': frames,
+            'frames_per_cpu_second': frames / cpu if cpu else None,
+            'frames_per_second': frames / wall if wall else None,
+        }
+
+    return results
+
+
+async def bench_guilds(guilds: int, tracks: int, seconds: int, *, encoder=None):
+    """
+    Plays `tracks` songs in each of `guilds` simulated guilds at once,
+    the way `add` command enqueues them.
+    """
+    loop = asyncio.get_event_loop()
+    bot = SimpleNamespace(loop=loop)
+
+    voices = []
+    for guild_id in range(1, guilds + 1):
+        ctx = fakes.fake_context(guild_id)
+        voice = Voice(bot, ctx)
+        voice.voice = fakes.FakeVoiceClient(encoder=encoder)
+        voices.append((voice, ctx))
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for voice, ctx in voices:
+        for index in range(tracks):
+            song = Song(query=fakes.track_url(ctx.guild.id * tracks + index), ctx=ctx)
+            await voice.songs.put(song)
+        voice.prefetch()
+
+    # every song has to end, with some room for slow machines
+    deadline = start + tracks * seconds * 2 + 30
+    while time.perf_counter() < deadline:
+        if all(len(voice.voice.tracks) >= tracks and not voice.voice.is_playing() for voice, _ in voices):
+            break
+        await asyncio.sleep(0.1)
+    wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+
+    first_audio, gaps, frames, late, completed = [], [], 0, 0, 0
+    for voice, _ in voices:
+        completed += len(voice.voice.tracks) >= tracks
+        played = [track for track in voice.voice.tracks if track['first_frame'] is not None]
+        if played:
+            first_audio.append(played[0]['first_frame'] - start)
+        for previous, track in zip(played, played[1:]):
+            gaps.append(track['first_frame'] - previous['last_frame'] - fakes.FRAME_LENGTH)
+        frames += sum(track['frames'] for track in played)
+        late += voice.voice.late_frames
+
+        await voice.close()
+
+    return {
+        'guilds': guilds,
+        'completed': completed,
+        'frames': frames,
+        'late_frames': late,
+        'frames_per_cpu_second': frames / cpu if cpu else None,
+        'cpu_per_audio_second': cpu / (frames * fakes.FRAME_LENGTH) if frames else None,
+        'wall': wall,
+        'time_to_first_audio': _summary(first_audio),
+        'gap': _summary(gaps),
+    }
+
+
+def _summary(values: list):
+    if not values:
+        return None
+
+    values = sorted(values)
+    return {
+        'mean': statistics.mean(values),
+        'p50': values[len(values) // 2],
+        'p95': values[min(int(len(values) * 0.95), len(values) - 1)],
+        'max': values[-1],
+    }
+
+
+def _meta(args: argparse.Namespace):
+    try:
+        ffmpeg = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    except OSError:
+        ffmpeg = None
+
+    return {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'discord': discord.__version__,
+        'numpy': volume.numpy.__version__ if volume.numpy else None,
+        'ffmpeg': ffmpeg,
+        'opus_encoding': discord.opus.is_loaded(),
+        'args': vars(args),
+    }
+
+
+async def run(args: argparse.Namespace):
+    results = {'queue': bench_queue()}
+    if args.queue_only:
+        return results
+
+    with tempfile.TemporaryDirectory() as directory:
+        # nothing is read from or written to real caches
+        YTDLSource.cache = MetadataCache(os.path.join(directory, 'cache.sqlite3'))
+        YTDLSource.history = PlayHistory(os.path.join(directory, 'history.sqlite3'))
+        YTDLSource.audio_cache = AudioCache(os.path.join(directory, 'audio'))
+        YTDLSource.FFMPEG_OPTIONS = {'before_options': '', 'options': '-vn'}
+
+        paths = fakes.generate_tracks(directory, args.tracks, args.seconds)
+        YTDLSource.ytdl = fakes.FakeYoutubeDL(paths, seconds=args.seconds, latency=args.latency)
+
+        encoder = discord.opus.Encoder() if discord.opus.is_loaded() else None
+        ctx = fakes.fake_context(0)
+        results['decode'] = bench_decode(YTDLSource.ytdl.extract_info(fakes.track_url(0)), ctx)
+        results['playback'] = await bench_guilds(1, args.tracks, args.seconds, encoder=encoder)
+        if args.guilds > 1:
+            results['guilds'] = await bench_guilds(args.guilds, args.tracks, args.seconds, encoder=encoder)
+        results['extractions'] = YTDLSource.ytdl.calls
+
+    YTDLSource.scheduler.shutdown()
+    return results
+
+
+def _flatten(data, prefix: str = ''):
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from _flatten(value, f'{prefix}.{key}' if prefix else key)
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        yield prefix, data
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as file:
+        old = dict(_flatten(json.load(file)['results']))
+    with open(new_path) as file:
+        new = dict(_flatten(json.load(file)['results']))
+
+    for name in sorted(old.keys() & new.keys()):
+        change = f'{(new[name] - old[name]) / old[name] * 100:+7.1f}%' if old[name] else ''
+        print(f'{name:<55} {old[name]:>14.4f} {new[name]:>14.4f} {change}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks of playback and queue.')
+    parser.add_argument('--guilds', type=int, default=20, help='simulated guilds playing at once')
+    parser.add_argument('--tracks', type=int, default=3, help='tracks played by each guild')
+    parser.add_argument('--seconds', type=int, default=8, help='length of each track')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated extraction latency, seconds')
+    parser.add_argument('--queue-only', action='store_true', help='skip benchmarks which need FFmpeg')
+    parser.add_argument('--output', help='result file, `benchmarks/results/DATE.json` by default')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+
+    results = asyncio.get_event_loop().run_until_complete(run(args))
+
+    output = args.output or os.path.join(
+        'benchmarks', 'results', f'{datetime.datetime.now():%Y%m%d-%H%M%S}.json'
+    )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({'meta': _meta(args), 'results': results}, file, indent=2)
+
+    print(json.dumps(results, indent=2))
+    print(f'Saved to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Compares CPU cost per 20 ms frame of `discord.PCMVolumeTransformer`
+and `audio_sources.volume.VolumeTransformer`.
+
+Usage: python -m benchmarks.volume [frames] [repeats]
+"""
+import os
+import sys
+import time
+
+import discord
+
+from audio_sources import volume
+
+
+FRAME = os.urandom(discord.opus.Encoder.FRAME_SIZE)
+
+
+class _Silence(discord.AudioSource):
+    """
+    Endless source returning the same PCM frame.
+    """
+    def read(self):
+        return FRAME
+
+
+def _measure(transformer, frames: int):
+    start = time.process_time()
+    for _ in range(frames):
+        transformer.read()
+
+    return (time.process_time() - start) / frames * 1e6
+
+
+def main(frames: int = 100000, repeats: int = 5):
+    amplified = volume.VolumeTransformer(_Silence(), 0.5)
+    amplified.gain = 3.0
+    transformers = {
+        'PCMVolumeTransformer': discord.PCMVolumeTransformer(_Silence(), 0.5),
+        'VolumeTransformer': volume.VolumeTransformer(_Silence(), 0.5),
+        'VolumeTransformer (gain > 1)': amplified,
+    }
+
+    # runs are interleaved and the best one is kept, so
+    # noise of shared machines affects all transformers alike
+    results = dict.fromkeys(transformers, float('inf'))
+    for _ in range(repeats):
+        for name, transformer in transformers.items():
+            results[name] = min(results[name], _measure(transformer, frames // repeats))
+
+    print(f'numpy: {volume.numpy.__version__ if volume.numpy else "not installed"}')
+    for name, cost in results.items():
+        print(f'{name:<30} {cost:6.2f} us/frame')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
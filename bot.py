@@ -1,28 +1,45 @@
 import sys
+import time
 
 from discord.ext import commands
 
+from core import diagnostics
 from core.cog import AudioStreamerCog
 
 
-if len(sys.argv) != 3:
-    print('Usage: bot.py <bot name> <bot token>')
-    sys.exit(2)
-
-bot_name = sys.argv[1]
-bot_token = sys.argv[2]
-
-bot = commands.Bot(
-    description=f'AudioStreamer Bot {bot_name}',
-    command_prefix=f'{bot_name}.',
-    help_command=None,
-)
-bot.add_cog(AudioStreamerCog(bot))
-
-
-@bot.event
-async def on_ready():
-    print(f'Bot {bot_name} logged in as:\n{bot.user.name}\n{bot.user.id}')
-
-
-bot.run(f'{bot_token}')
+def create_bot(bot_name: str, *, shard_id: int = None, shard_count: int = None):
+    """
+    Creates bot with AudioStreamerCog. With `shard_id` and `shard_count`
+    bot handles only guilds of given shard (see `supervisor.py`).
+    """
+    bot = commands.Bot(
+        description=f'AudioStreamer Bot {bot_name}',
+        command_prefix=f'{bot_name}.',
+        help_command=None,
+        shard_id=shard_id,
+        shard_count=shard_count,
+    )
+    cog = AudioStreamerCog(bot)
+    bot.add_cog(cog)
+    if diagnostics.DIAGNOSTICS:
+        diagnostics.install(bot)
+
+    @bot.event
+    async def on_ready():
+        shard = f' (shard {shard_id}/{shard_count})' if shard_count else ''
+        print(f'Bot {bot_name}{shard} logged in as:\n{bot.user.name}\n{bot.user.id}')
+        print(f'Connected in {time.perf_counter() - cog.created_at:.1f} s')
+
+    return bot
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: bot.py <bot name> <bot token>')
+        sys.exit(2)
+
+    bot_name = sys.argv[1]
+    bot_token = sys.argv[2]
+
+    bot = create_bot(bot_name)
+    bot.run(f'{bot_token}')
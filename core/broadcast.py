@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+import traceback
+from collections import deque
+
+import discord
+from discord.opus import Encoder
+
+from audio_sources.youtube import YTDLError
+from .song import SongQueue
+
+
+FRAME_LENGTH = 0.02  # 20 ms
+BACKLOG = 50  # packets kept for subscribers lagging behind, 1 sec
+SILENCE = b'\xf8\xff\xfe'  # Opus packet of silence, sent while station is idle
+
+
+class Station:
+    """
+    Shared stream played in many voice channels at once.
+
+    Each song is decoded (and encoded to Opus, unless source already
+    produces Opus) once by station's own thread, the same packets are
+    handed to every subscribed voice client. Subscribers are independent,
+    so tuning in or out of station doesn't interrupt others.
+
+    Volume is shared by all subscribers, as packets are encoded once.
+    """
+    def __init__(self, name: str, loop: asyncio.AbstractEventLoop):
+        self.name = name
+        self.songs = SongQueue()
+        self.current = None
+        self.volume = 0.5
+        self.listeners = set()
+        self.closed = False
+
+        self._loop = loop
+        self._packets = deque(maxlen=BACKLOG)
+        self._sequence = 0  # number of packets produced so far
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._done = asyncio.Event()
+
+        self._task = loop.create_task(self._run())
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    def subscribe(self):
+        """
+        Returns new audio source which plays station from current position.
+        """
+        listener = StationListener(self)
+        self.listeners.add(listener)
+        return listener
+
+    def unsubscribe(self, listener: 'StationListener'):
+        """
+        Removes listener, station is closed when the last one leaves.
+        """
+        self.listeners.discard(listener)
+        if not self.listeners:
+            self.close()
+
+    def close(self):
+        self.closed = True
+        self._stopped.set()
+        # current song is released by cancelled task
+        self._task.cancel()
+        self.songs.clear()
+
+    def packet(self, listener: 'StationListener'):
+        """
+        Returns next packet for `listener`, silence if
+        there is nothing new within one frame.
+        """
+        with self._condition:
+            if listener.position >= self._sequence:
+                self._condition.wait(FRAME_LENGTH)
+            if listener.position >= self._sequence:
+                return SILENCE
+
+            # subscriber which fell behind skips to the oldest kept packet
+            oldest = self._sequence - len(self._packets)
+            listener.position = max(listener.position, oldest)
+            packet = self._packets[listener.position - oldest]
+            listener.position += 1
+            return packet
+
+    async def _run(self):
+        while True:
+            song = await self.songs.get()
+            try:
+                await song.prepare(volume=self.volume)
+            except Exception as e:
+                # station goes on with the next song
+                if not isinstance(e, YTDLError):
+                    traceback.print_exc()
+                continue
+
+            self.current = song
+            self._done.clear()
+            threading.Thread(target=self._pump, args=(song.source,), name=f'station-{self.name}',
+                             daemon=True).start()
+            try:
+                await self._done.wait()
+            finally:
+                self.current = None
+                song.release()
+
+    def _pump(self, source: discord.AudioSource):
+        # paced the same way as `discord.player.AudioPlayer`
+        encoder = None if source.is_opus() else Encoder()
+        start = time.perf_counter()
+        count = 0
+        while not self._stopped.is_set():
+            data = source.read()
+            if not data:
+                break
+
+            packet = data if encoder is None else encoder.encode(data, Encoder.SAMPLES_PER_FRAME)
+            with self._condition:
+                self._packets.append(packet)
+                self._sequence += 1
+                self._condition.notify_all()
+
+            count += 1
+            time.sleep(max(0.0, start + FRAME_LENGTH * count - time.perf_counter()))
+
+        source.cleanup()
+        self._loop.call_soon_threadsafe(self._done.set)
+
+
+class StationListener(discord.AudioSource):
+    """
+    Audio source of single subscriber of `Station`.
+    """
+    def __init__(self, station: Station):
+        self.station = station
+        self.position = station.sequence
+
+    def read(self):
+        return self.station.packet(self)
+
+    def is_opus(self):
+        return True
@@ -1,18 +1,85 @@
+import asyncio
+import functools
 import math
-from copy import copy
+import re
+import time
+import traceback
 
 import discord
 from discord.ext import commands
 
+from audio_sources import loader, metrics
+from audio_sources.buffering import ReadAheadSource
 from audio_sources.youtube import YTDLError, YTDLSource
+from .broadcast import Station
 from .song import Song
 from .voice import Voice, VoiceError
 
 
+IDLE_TIMEOUT = 15 * 60  # guild state unused for this long is evicted, 15 min
+EVICT_INTERVAL = 60  # 1 min
+HISTORY_PAGE_SIZE = 10
+
+
+def _format_size(size: int):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}'
+        size /= 1024
+
+    return f'{size:.1f} GiB'
+
+
+def _tracks_embed(title: str, total: int, rows: list, page: int):
+    start = (page - 1) * HISTORY_PAGE_SIZE
+    lines = []
+    for i, row in enumerate(rows, start=start + 1):
+        plays = f' ({row["plays"]} plays)' if row['plays'] else ''
+        lines.append(f'`{i}.` [**{row["title"]}**]({row["url"]}) by {row["uploader"]}{plays}')
+
+    return (
+        discord.Embed(
+            title=title,
+            description=f'**{total} tracks:**\n\n' + '\n'.join(lines),
+            color=discord.Color.from_rgb(69, 38, 53))
+        .set_footer(text=f'Viewing page {page}/{max(math.ceil(total / HISTORY_PAGE_SIZE), 1)}')
+    )
+
+
 class AudioStreamerCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.voice_states = {}
+        self.stations = {}  # name -> Station shared by guilds
+        self.evictor = bot.loop.create_task(self._evict_idle())
+
+        self.created_at = time.perf_counter()
+        self.connected_in = None  # seconds from cog creation to first `on_ready`
+
+        self._register_gauges()
+        self.exporters = metrics.start(bot.loop)
+
+    def _register_gauges(self):
+        states = self.voice_states
+        metrics.gauge('guilds_active', 'Guilds with voice state', lambda: len(states))
+        metrics.gauge('guilds_playing', 'Guilds playing audio',
+                      lambda: sum(1 for state in states.values() if state.is_playing))
+        metrics.gauge('queued_songs', 'Songs in all queues',
+                      lambda: sum(len(state.songs) for state in states.values()))
+        metrics.gauge('queued_songs_max', 'Songs in the longest queue',
+                      lambda: max((len(state.songs) for state in states.values()), default=0))
+        metrics.gauge('read_ahead_underruns_total', 'Read-ahead buffer underruns',
+                      lambda: ReadAheadSource.totals['underruns'])
+        metrics.gauge('read_ahead_stalled_seconds_total', 'Time voice send loop waited for read-ahead buffer',
+                      lambda: ReadAheadSource.totals['stalled'])
+        metrics.gauge('extractions_queued', 'youtube-dl jobs waiting for worker',
+                      lambda: sum(pool['queued'] for pool in YTDLSource.scheduler.stats.values()))
+        metrics.gauge('metadata_cache_hits_total', 'Metadata cache hits',
+                      lambda: YTDLSource.cache.stats['hits'])
+        metrics.gauge('metadata_cache_misses_total', 'Metadata cache misses',
+                      lambda: YTDLSource.cache.stats['misses'])
+        metrics.gauge('resolutions_coalesced_total', 'Resolutions which joined identical one in progress',
+                      lambda: YTDLSource.coalesced)
 
     def get_voice_state(self, ctx: commands.Context):
         state = self.voice_states.get(ctx.guild.id)
@@ -22,9 +89,62 @@ class AudioStreamerCog(commands.Cog):
 
         return state
 
+    async def evict(self, guild_id: int):
+        """
+        Drops guild state, freeing its songs, sources and tasks.
+        """
+        state = self.voice_states.pop(guild_id, None)
+        if state is not None:
+            await state.close()
+
+    async def _evict_idle(self):
+        while True:
+            await asyncio.sleep(EVICT_INTERVAL)
+            for guild_id, state in list(self.voice_states.items()):
+                idle_for = state.idle_for
+                # player task ends (and disconnects) after SONG_QUEUE_TIMEOUT,
+                # such state is dropped unless it's being used right now
+                if idle_for > IDLE_TIMEOUT or (state.audio_player.done() and idle_for > EVICT_INTERVAL):
+                    try:
+                        await self.evict(guild_id)
+                    except Exception:
+                        traceback.print_exc()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self.connected_in is None:
+            self.connected_in = time.perf_counter() - self.created_at
+
+        # youtube-dl isn't imported until it's needed,
+        # load it while nobody is waiting for it
+        if loader.WARM_UP:
+            await YTDLSource.warm_up()
+
     def cog_unload(self):
+        self.evictor.cancel()
+        for task in self.exporters:
+            task.cancel()
         for state in self.voice_states.values():
-            self.bot.loop.create_task(state.suspend())
+            self.bot.loop.create_task(state.close())
+        for station in self.stations.values():
+            station.close()
+        YTDLSource.scheduler.shutdown()
+
+    def stats(self):
+        """
+        Counters of this bot process, collected by supervisor
+        of sharded deployment.
+        """
+        return {
+            'guilds': len(self.bot.guilds),
+            'voice_states': len(self.voice_states),
+            'playing': sum(1 for state in self.voice_states.values() if state.is_playing),
+            'stations': sum(1 for station in self.stations.values() if not station.closed),
+            'memory': sum(state.memory() for state in self.voice_states.values()),
+            'metadata_cache': YTDLSource.cache.stats,
+            'audio_cache': YTDLSource.audio_cache.stats,
+            'pools': YTDLSource.scheduler.stats,
+        }
 
     def cog_check(self, ctx: commands.Context):
         if not ctx.guild:
@@ -33,7 +153,12 @@ class AudioStreamerCog(commands.Cog):
         return True
 
     async def cog_before_invoke(self, ctx: commands.Context):
+        ctx.invoked_at = time.perf_counter()
         ctx.voice_state = self.get_voice_state(ctx)
+        ctx.voice_state.touch()
+
+    async def cog_after_invoke(self, ctx: commands.Context):
+        metrics.observe('command_seconds', time.perf_counter() - ctx.invoked_at, command=ctx.command.name)
 
     async def cog_command_error(self, ctx: commands.Context,
                                 error: commands.CommandError):
@@ -66,19 +191,27 @@ class AudioStreamerCog(commands.Cog):
         if not ctx.voice_state.voice:
             return await ctx.send('Not connected to any voice channel.')
 
-        await ctx.voice_state.suspend()
-        del self.voice_states[ctx.guild.id]
+        await self.evict(ctx.guild.id)
 
     @commands.command(name='now', aliases=['current', 'playing'])
     @commands.has_permissions(manage_guild=True)
     async def _now(self, ctx: commands.Context):
         """Displays the currently playing song."""
 
+        station = ctx.voice_state.station
+        if station is not None:
+            if station.current is None:
+                return await ctx.send(f'Station `{station.name}` is waiting for songs.')
+            return await ctx.send(
+                embed=station.current.create_embed(volume=station.volume)
+            )
+
         if ctx.voice_state.current:
             await ctx.send(
-                embed=ctx.voice_state.current.create_embed()
-                .add_field(name='Loop', value=ctx.voice_state.loop)
-                .add_field(name='Volume', value=int(ctx.voice_state.volume * 100))
+                embed=ctx.voice_state.current.create_embed(
+                    loop=ctx.voice_state.loop,
+                    volume=ctx.voice_state.volume,
+                )
             )
         else:
             await ctx.send('Nothing is queued')
@@ -106,6 +239,9 @@ class AudioStreamerCog(commands.Cog):
     async def _stop(self, ctx: commands.Context):
         """Stops playing song and clears the queue."""
 
+        ctx.voice_state.stop_playlists()
+        # song being prepared in advance would be left warm
+        ctx.voice_state.stop_prewarm()
         ctx.voice_state.songs.clear()
 
         ctx.voice_state.loop = False
@@ -119,6 +255,9 @@ class AudioStreamerCog(commands.Cog):
     async def _skip(self, ctx: commands.Context):
         """Skip a song."""
 
+        if ctx.voice_state.station is not None:
+            return await self._tuned_in(ctx)
+
         if not ctx.voice_state.is_playing:
             return await ctx.send('Not playing any music right now...')
 
@@ -137,23 +276,51 @@ class AudioStreamerCog(commands.Cog):
         if len(ctx.voice_state.songs) == 0:
             return await ctx.send('Empty queue.')
 
-        items_per_page = 10
-        pages = math.ceil(len(ctx.voice_state.songs) / items_per_page)
+        await ctx.send(embed=ctx.voice_state.songs.create_embed(page))
+
+    @commands.command(name='history')
+    @commands.has_permissions(manage_guild=True)
+    async def _history(self, ctx: commands.Context, *, page: int = 1):
+        """Shows recently played tracks."""
 
-        start = (page - 1) * items_per_page
-        end = start + items_per_page
+        if page < 1:
+            raise VoiceError('**Page numbers start at 1**')
 
-        queue = ''
-        for i, song in enumerate(ctx.voice_state.songs[start:end], start=start):
-            queue += f'`{i}.` [**{song.source.title}**]({song.source.url})\n'
+        total, rows = await self.bot.loop.run_in_executor(None, functools.partial(
+            YTDLSource.history.recent,
+            limit=HISTORY_PAGE_SIZE,
+            offset=(page - 1) * HISTORY_PAGE_SIZE,
+        ))
+        if not rows:
+            return await ctx.send('No tracks played yet.' if page == 1 else 'No such page.')
 
-        embed = (
-            discord.Embed(
-                description=f'**{len(ctx.voice_state.songs)} tracks:**\n\n{queue}',
-                color=discord.Color.from_rgb(69, 38, 53))
-            .set_footer(text=f'Viewing page {page}/{pages}')
-        )
-        await ctx.send(embed=embed)
+        await ctx.send(embed=_tracks_embed('History', total, rows, page))
+
+    @commands.command(name='search')
+    @commands.has_permissions(manage_guild=True)
+    async def _search(self, ctx: commands.Context, *, search: str = ''):
+        """
+        Searches previously played tracks by title, uploader and tags.
+        You can optionally specify the page to show after keywords as `#PAGE`.
+        """
+
+        # page follows keywords, so keywords can start with a number
+        match = re.fullmatch(r'(.*?)\s*#(\d+)', search)
+        page = int(match.group(2)) if match else 1
+        search = match.group(1) if match else search
+        if page < 1:
+            raise VoiceError('**Page numbers start at 1**')
+
+        total, rows = await self.bot.loop.run_in_executor(None, functools.partial(
+            YTDLSource.history.search,
+            search,
+            limit=HISTORY_PAGE_SIZE,
+            offset=(page - 1) * HISTORY_PAGE_SIZE,
+        ))
+        if not rows:
+            return await ctx.send(f'Nothing matches `{search}` in history.')
+
+        await ctx.send(embed=_tracks_embed(f'Search: {search}', total, rows, page))
 
     @commands.command(name='shuffle')
     @commands.has_permissions(manage_guild=True)
@@ -164,6 +331,7 @@ class AudioStreamerCog(commands.Cog):
             return await ctx.send('Empty queue.')
 
         ctx.voice_state.songs.shuffle()
+        ctx.voice_state.prefetch()
         await ctx.message.add_reaction('✅')
 
     @commands.command(name='remove')
@@ -177,31 +345,66 @@ class AudioStreamerCog(commands.Cog):
         ctx.voice_state.songs.remove(index - 1)
         await ctx.message.add_reaction('✅')
 
+    @commands.command(name='move')
+    @commands.has_permissions(manage_guild=True)
+    async def _move(self, ctx: commands.Context, index: int, position: int):
+        """Moves a song at a given index to a given position in the queue."""
+
+        if len(ctx.voice_state.songs) == 0:
+            return await ctx.send('Empty queue.')
+
+        ctx.voice_state.songs.move(index - 1, position - 1)
+        ctx.voice_state.prefetch()
+        await ctx.message.add_reaction('✅')
+
+    @commands.command(name='insert')
+    @commands.has_permissions(manage_guild=True)
+    async def _insert(self, ctx: commands.Context, position: int, *, search: str = ''):
+        """Adds a song to the queue at a given position."""
+
+        if not search:
+            raise VoiceError('**Please provide URL or search keywords**')
+
+        if not ctx.voice_state.voice:
+            await ctx.invoke(self._join)
+
+        song = Song(query=search, ctx=ctx)
+        ctx.voice_state.songs.insert(position - 1, song)
+        ctx.voice_state.prefetch()
+        ctx.voice_state.notifier.enqueued(ctx.channel, f'Enqueued {str(song)} at position {position}')
+
     @commands.command(name='loop')
     @commands.has_permissions(manage_guild=True)
     async def _loop(self, ctx: commands.Context):
         """Loops/unloops the currently playing song."""
 
+        if ctx.voice_state.station is not None:
+            return await self._tuned_in(ctx)
+
         if not ctx.voice_state.is_playing:
             return await ctx.send('Nothing being played at the moment.')
 
         ctx.voice_state.loop = not ctx.voice_state.loop
 
         if ctx.voice_state.loop and ctx.voice_state.current.state == 'stream':
-            url = ctx.voice_state.current.source.stream_url
-
             await ctx.message.add_reaction('📥')
+            await ctx.voice_state.current.download()
 
-            ctx.voice_state.current.state = 'downloading'
+        await ctx.message.add_reaction('✅')
 
-            await YTDLSource.download(
-                filename=f'{self.bot.command_prefix}.mp3'.replace('..', '.'),
-                loop=self.bot.loop,
-                url=url,
-            )
-            ctx.voice_state.current.state = 'downloaded'
+    @commands.command(name='replay')
+    @commands.has_permissions(manage_guild=True)
+    async def _replay(self, ctx: commands.Context):
+        """Plays the current (or just finished) song again from the start."""
 
-        await ctx.message.add_reaction('✅')
+        if ctx.voice_state.station is not None:
+            return await self._tuned_in(ctx)
+
+        if not ctx.voice_state.voice or not ctx.voice_state.current:
+            return await ctx.send('Nothing was played yet.')
+
+        ctx.voice_state.replay()
+        await ctx.message.add_reaction('🔁')
 
     @commands.command(name='add')
     @commands.has_permissions(manage_guild=True)
@@ -212,13 +415,28 @@ class AudioStreamerCog(commands.Cog):
         A list of these sites can be found here: https://rg3.github.io/youtube-dl/supportedsites.html
         """
         async with ctx.typing():
+            if not search:
+                raise VoiceError('**Please provide URL or search keywords**')
+
+            if YTDLSource.is_playlist_url(search):
+                if not ctx.voice_state.voice:
+                    await ctx.invoke(self._join)
+                ctx.voice_state.add_playlist(ctx, search)
+                return ctx.voice_state.notifier.enqueued(ctx.channel, f'Enqueued playlist `{search}`')
+
+            # song is resolved by player shortly before it's played
+            song = Song(query=search, ctx=ctx)
             if not ctx.voice_state.voice:
+                # nothing is playing, so song is played right away:
+                # it's resolved while connecting to voice channel
+                song.requested_at = ctx.invoked_at
+                song.prefetch()
                 await ctx.invoke(self._join)
 
-            song = await self.song_from_yotube(ctx, search)
-
             await ctx.voice_state.songs.put(song)
-            await ctx.send(f'Enqueued {str(song.source)}')
+            ctx.voice_state.prefetch()
+            # confirmations of bursts of `add` are merged into one message
+            ctx.voice_state.notifier.enqueued(ctx.channel, f'Enqueued {str(song)}')
 
     @commands.command(name='play')
     @commands.has_permissions(manage_guild=True)
@@ -232,22 +450,22 @@ class AudioStreamerCog(commands.Cog):
         """
 
         async with ctx.typing():
-            if not ctx.voice_state.voice:
-                await ctx.invoke(self._join)
+            if YTDLSource.is_playlist_url(search):
+                if not ctx.voice_state.voice:
+                    await ctx.invoke(self._join)
+                # playlist is added to the end of queue, its
+                # first song starts as soon as it's resolved
+                ctx.voice_state.add_playlist(ctx, search)
+                if ctx.voice_state.audio_player.done():
+                    ctx.voice_state.start_player()
+                return ctx.voice_state.notifier.enqueued(ctx.channel, f'Enqueued playlist `{search}`')
 
             song = await self.song_from_yotube(ctx, search)
+            if song is None:
+                return
 
             if ctx.voice_state.is_playing:
-
-                previously_added_songs = [
-                    copy(song_in_queue) for song_in_queue in ctx.voice_state.songs
-                ]
-                ctx.voice_state.songs.clear()
-                ctx.voice_state.songs.put_nowait(song)
-                for previously_added_song in previously_added_songs:
-                    ctx.voice_state.songs.put_nowait(previously_added_song)
-                del previously_added_songs
-
+                ctx.voice_state.songs.put_front(song)
                 await ctx.invoke(self._skip)
             else:
                 await ctx.voice_state.songs.put(song)
@@ -258,11 +476,85 @@ class AudioStreamerCog(commands.Cog):
             if ctx.voice_state.audio_player.done():
                 ctx.voice_state.start_player()
 
+    @commands.command(name='broadcast')
+    @commands.has_permissions(manage_guild=True)
+    async def _broadcast(self, ctx: commands.Context, name: str, *, search: str = ''):
+        """
+        Adds a song to broadcast station `name`, starting the station if needed,
+        and tunes this guild in. Station is played in every guild tuned in,
+        while decoded only once.
+        """
+        if not search:
+            raise VoiceError('**Please provide URL or search keywords**')
+
+        async with ctx.typing():
+            if not ctx.voice_state.voice:
+                await ctx.invoke(self._join)
+
+            station = self.stations.get(name)
+            if station is None or station.closed:
+                station = self.stations[name] = Station(name, self.bot.loop)
+
+            song = Song(query=search, ctx=ctx)
+            await station.songs.put(song)
+            song.prefetch()
+
+            if ctx.voice_state.station is not station:
+                ctx.voice_state.tune(station)
+            ctx.voice_state.notifier.enqueued(ctx.channel, f'Enqueued {str(song)} on `{name}`')
+
+    @commands.command(name='tune')
+    @commands.has_permissions(manage_guild=True)
+    async def _tune(self, ctx: commands.Context, name: str):
+        """Stops own queue and plays broadcast station `name`."""
+
+        station = self.stations.get(name)
+        if station is None or station.closed:
+            return await ctx.send(f'No station `{name}`.')
+
+        if not ctx.voice_state.voice:
+            await ctx.invoke(self._join)
+        ctx.voice_state.tune(station)
+        await ctx.message.add_reaction('📻')
+
+    @commands.command(name='untune')
+    @commands.has_permissions(manage_guild=True)
+    async def _untune(self, ctx: commands.Context):
+        """Stops playing broadcast station."""
+
+        if ctx.voice_state.station is None:
+            return await ctx.send('Not tuned in any station.')
+
+        ctx.voice_state.untune()
+        await ctx.message.add_reaction('⏹')
+
+    @commands.command(name='stations')
+    @commands.has_permissions(manage_guild=True)
+    async def _stations(self, ctx: commands.Context):
+        """Lists broadcast stations."""
+
+        stations = [station for station in self.stations.values() if not station.closed]
+        if not stations:
+            return await ctx.send('No stations.')
+
+        await ctx.send('\n'.join(
+            f'`{station.name}`: {len(station.listeners)} guilds, '
+            f'playing {str(station.current) if station.current else "nothing"}, '
+            f'{len(station.songs)} queued'
+            for station in stations
+        ))
+
     @commands.command(name='volume')
     @commands.has_permissions(manage_guild=True)
     async def _volume(self, ctx: commands.Context, *, volume: int = -1):
         """Sets the volume of the player."""
 
+        station = ctx.voice_state.station
+        if station is not None:
+            # packets are encoded once for all servers tuned in
+            return await ctx.send(f'Station `{station.name}` plays at {station.volume * 100:.0f}% '
+                                  f'in every server tuned in, volume can\'t be changed per server.')
+
         if not ctx.voice_state.is_playing:
             return await ctx.send('Nothing being played at the moment.')
 
@@ -275,6 +567,68 @@ class AudioStreamerCog(commands.Cog):
         ctx.voice_state.volume = volume / 100
         await ctx.send(f'Volume of the player set to {volume}%')
 
+    @commands.command(name='stats')
+    @commands.has_permissions(manage_guild=True)
+    async def _stats(self, ctx: commands.Context):
+        """Displays bot performance counters."""
+        cache = YTDLSource.cache.stats
+        stats = (
+            discord.Embed(title='Stats', color=discord.Color.from_rgb(142, 192, 124))
+            .add_field(name='Metadata cache',
+                       value=f'hits: {cache["hits"]}\n'
+                             f'stale: {cache["stale_hits"]}\n'
+                             f'misses: {cache["misses"]}\n'
+                             f'in memory: {cache["memory_entries"]}\n'
+                             f'coalesced: {YTDLSource.coalesced}')
+        )
+        for phase, (count, total, last) in YTDLSource.timings.items():
+            stats.add_field(name=f'Resolve: {phase}',
+                            value=f'count: {count}\n'
+                                  f'avg: {total / count * 1000:.0f} ms\n'
+                                  f'last: {last * 1000:.0f} ms')
+        for name, pool in YTDLSource.scheduler.stats.items():
+            stats.add_field(name=f'Pool: {name}',
+                            value=f'running: {pool["running"]}/{pool["workers"]}\n'
+                                  f'queued: {pool["queued"]}\n'
+                                  f'avg wait: {pool["avg_wait"] * 1000:.0f} ms\n'
+                                  f'max wait: {pool["max_wait"] * 1000:.0f} ms')
+        audio_cache = YTDLSource.audio_cache.stats
+        stats.add_field(name='Audio cache',
+                        value=f'hits: {audio_cache["hits"]}\n'
+                              f'misses: {audio_cache["misses"]}\n'
+                              f'in use: {audio_cache["in_use"]}')
+
+        startup = dict(loader.timings, connect=self.connected_in or 0.0)
+        stats.add_field(name='Startup',
+                        value='\n'.join(f'{phase}: {seconds * 1000:.0f} ms' for phase, seconds in startup.items()))
+
+        current = ctx.voice_state.current
+        read_ahead = current.source.read_ahead if current and current.source else None
+        if read_ahead is not None:
+            buffer = read_ahead.stats
+            totals = ReadAheadSource.totals
+            stats.add_field(name='Read-ahead buffer',
+                            value=f'fill: {buffer["fill"]}/{buffer["depth"]} ms\n'
+                                  f'underruns: {buffer["underruns"]} ({totals["underruns"]} total)\n'
+                                  f'max stall: {buffer["max_stall"] * 1000:.0f} ms\n'
+                                  f'avg read: {buffer["avg_read"] * 1000:.1f} ms')
+
+        await ctx.send(embed=stats)
+
+    @commands.command(name='memory')
+    @commands.has_permissions(manage_guild=True)
+    async def _memory(self, ctx: commands.Context):
+        """Displays approximate memory held by guild states."""
+
+        usage = sorted(((state.memory(), guild_id) for guild_id, state in self.voice_states.items()),
+                       reverse=True)
+        lines = [f'**{_format_size(sum(size for size, _ in usage))}** in {len(usage)} guilds']
+        for size, guild_id in usage[:10]:
+            guild = self.bot.get_guild(guild_id)
+            lines.append(f'{guild.name if guild else guild_id}: {_format_size(size)}')
+
+        await ctx.send('\n'.join(lines))
+
     @commands.command(name='help')
     @commands.has_permissions(manage_guild=True)
     async def _help(self, ctx: commands.Context):
@@ -283,38 +637,68 @@ class AudioStreamerCog(commands.Cog):
             discord.Embed(title='Usage',
                           description=f'**All commands must be used with bot prefix `{ctx.prefix}`!**',
                           color=discord.Color.from_rgb(142, 192, 124))
-            .add_field(name='add `URL/search`', value='add `URL` or first suitable `search` to *queue*')
+            .add_field(name='add `URL/search`', value='add `URL`, playlist or first suitable `search` to *queue*')
             .add_field(name='play `URL/search`', value='play `URL` or first suitable `search`')
             .add_field(name='pause/resume/stop', value='control playback')
             .add_field(name='skip', value='go to next song in *queue*')
-            .add_field(name='loop', value='repeat current song, file is downloaded')
+            .add_field(name='loop', value='repeat current song, file is downloaded and cached')
+            .add_field(name='replay', value='play current or just finished song again')
             .add_field(name='now', value='show current song')
             .add_field(name='queue', value='show current song *queue*')
             .add_field(name='shuffle', value='shuffle *queue*')
             .add_field(name='remove `NUM`', value='remove `NUM`th song from queue')
+            .add_field(name='move `NUM` `POS`', value='move `NUM`th song to position `POS` in queue')
+            .add_field(name='insert `POS` `URL/search`', value='add `URL` or `search` at position `POS` in queue')
             .add_field(name='join `NAME`',
                        value='add bot to your **current** voice channel or to channel `NAME` if provided')
             .add_field(name='leave', value='remove bot from current voice channel')
-            .add_field(name='volume `1-100`', value='show current volume or change volume to `1-100`'))
+            .add_field(name='broadcast `NAME` `URL/search`',
+                       value='add `URL` or `search` to station `NAME` shared with other servers and tune in')
+            .add_field(name='tune `NAME`/untune', value='play station `NAME` instead of own queue or stop it')
+            .add_field(name='stations', value='list broadcast stations')
+            .add_field(name='volume `1-100`', value='show current volume or change volume to `1-100`')
+            .add_field(name='history `PAGE`', value='show recently played tracks')
+            .add_field(name='search `keywords` `#PAGE`', value='search previously played tracks')
+            .add_field(name='stats', value='show cache and performance counters')
+            .add_field(name='memory', value='show memory held by servers'))
 
         await ctx.send(embed=help_page)
 
+    @staticmethod
+    async def _tuned_in(ctx: commands.Context):
+        await ctx.send(f'Playing station `{ctx.voice_state.station.name}`, use `untune` to return to own queue.')
+
     @_join.before_invoke
     @_play.before_invoke
+    @_broadcast.before_invoke
+    @_tune.before_invoke
     async def ensure_voice_state(self, ctx: commands.Context):
         if not ctx.author.voice or not ctx.author.voice.channel:
             raise commands.CommandError('You are not connected to any voice channel.')
 
     async def song_from_yotube(self, ctx: commands.Context, search: str):
+        """
+        Returns song of `search` ready to play (resolved, FFmpeg spawned
+        and first frame decoded), joining voice channel meanwhile.
+        """
         if not search:
             raise VoiceError('**Please provide URL or search keywords**')
 
+        song = Song(query=search, ctx=ctx)
+        song.requested_at = ctx.invoked_at
+        # voice handshake and extraction take similar time, they run at once
+        preparing = self.bot.loop.create_task(song.prepare(volume=ctx.voice_state.volume, prebuffer=1))
         try:
-            source = await YTDLSource.create_source(
-                ctx, search,
-                loop=self.bot.loop,
-            )
+            if not ctx.voice_state.voice:
+                await ctx.invoke(self._join)
+            await preparing
         except YTDLError as e:
             await ctx.send(f'An error occurred while processing this request: {str(e)}')
+        except BaseException:
+            # e.g. failed to join, prepared source won't be played
+            preparing.cancel()
+            preparing.add_done_callback(lambda task: task.cancelled() or task.exception())
+            song.cool()
+            raise
         else:
-            return Song(source=source)
+            return song
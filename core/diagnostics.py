@@ -0,0 +1,216 @@
+import asyncio
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from discord.ext import commands
+
+from audio_sources import metrics
+
+
+# opt-in, e.g. `AUDIO_STREAMER_DIAGNOSTICS=1 python3 bot.py ...`
+DIAGNOSTICS = os.environ.get('AUDIO_STREAMER_DIAGNOSTICS', '') not in ('', '0')
+LAG_INTERVAL = 0.25  # seconds between event loop lag samples
+SLOW_CALLBACK = 0.05  # callbacks blocking event loop for longer are logged
+SLOW_CALLBACKS_KEPT = 20
+PROFILE_INTERVAL = 0.005  # seconds between stack samples
+MAX_PROFILE_SECONDS = 60
+# top frames of threads waiting for something, not using CPU
+IDLE_FUNCTIONS = ('select', 'poll', 'wait', '_wait_for_tstate_lock', 'get', 'accept', 'readinto')
+
+log = logging.getLogger(__name__)
+
+# name of command being handled by the task, see `install()`
+current_command = contextvars.ContextVar('current_command', default=None)
+
+
+class LoopMonitor:
+    """
+    Samples event loop lag (how late `sleep()` wakes up) and
+    records callbacks which blocked event loop for `SLOW_CALLBACK`.
+
+    Every callback is timed by patched `asyncio.Handle._run()`,
+    which costs two clock reads per callback.
+    """
+    def __init__(self):
+        self.samples = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lag_last = 0.0
+        self.slow = deque(maxlen=SLOW_CALLBACKS_KEPT)  # (time, seconds, description)
+
+        self._task = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        _patch_handle(self)
+        self._task = loop.create_task(self._sample())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _sample(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            lag = max(loop.time() - start - LAG_INTERVAL, 0.0)
+
+            self.samples += 1
+            self.lag_total += lag
+            self.lag_last = lag
+            self.lag_max = max(self.lag_max, lag)
+            metrics.observe('loop_lag_seconds', lag)
+
+    def report_slow(self, handle: asyncio.Handle, seconds: float):
+        description = _describe(handle)
+        self.slow.append((time.time(), seconds, description))
+        log.warning('Event loop blocked for %.3f s by %s', seconds, description)
+
+
+def _patch_handle(monitor: LoopMonitor):
+    run = asyncio.Handle._run
+    if getattr(run, 'monitored', False):
+        return
+
+    def _run(handle):
+        start = time.perf_counter()
+        run(handle)
+        elapsed = time.perf_counter() - start
+        if elapsed >= SLOW_CALLBACK:
+            monitor.report_slow(handle, elapsed)
+
+    _run.monitored = True
+    asyncio.Handle._run = _run
+
+
+def _describe(handle: asyncio.Handle):
+    """
+    Names task (and command it handles) or function behind `handle`.
+    """
+    callback = handle._callback
+    owner = getattr(callback, '__self__', None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        description = f'task {getattr(coro, "__qualname__", coro)}'
+        frame = getattr(coro, 'cr_frame', None)
+        if frame is not None:
+            # where task is suspended now, right after blocking code
+            description += f' at {frame.f_code.co_filename}:{frame.f_lineno}'
+            # e.g. `Voice.audio_player_task` of some guild, `Voice` keeps it as `_ctx`
+            instance = frame.f_locals.get('self')
+            ctx = getattr(instance, 'ctx', None) or getattr(instance, '_ctx', None)
+            if getattr(ctx, 'guild', None) is not None:
+                description += f' in guild {ctx.guild.id}'
+    else:
+        description = getattr(callback, '__qualname__', repr(callback))
+
+    command = handle._context.get(current_command) if handle._context else None
+    if command:
+        description += f' (command `{command}`)'
+
+    return description
+
+
+def profile(seconds: float, *, interval: float = PROFILE_INTERVAL, top: int = 15):
+    """
+    Samples stacks of all threads for `seconds` and returns
+    `(samples, [(function, own samples, total samples)])` of the hottest
+    functions. Blocking, should be called from executor.
+    """
+    own = Counter()
+    total = Counter()
+    samples = 0
+    me = threading.get_ident()
+
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me or frame.f_code.co_name in IDLE_FUNCTIONS:
+                continue
+
+            own[_function(frame)] += 1
+            # recursive functions are counted once per sample
+            for function in {_function(frame) for frame in _stack(frame)}:
+                total[function] += 1
+        samples += 1
+        time.sleep(interval)
+
+    return samples, [(function, count, total[function]) for function, count in own.most_common(top)]
+
+
+def _stack(frame):
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+
+
+def _function(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.relpath(code.co_filename)}:{code.co_firstlineno})'
+
+
+class DiagnosticsCog(commands.Cog):
+    """
+    Owner-only commands reporting event loop health and profiling the bot.
+    """
+    def __init__(self, bot: commands.Bot, monitor: LoopMonitor):
+        self.bot = bot
+        self.monitor = monitor
+
+    def cog_unload(self):
+        self.monitor.stop()
+
+    async def cog_check(self, ctx: commands.Context):
+        return await self.bot.is_owner(ctx.author)
+
+    @commands.command(name='lag')
+    async def _lag(self, ctx: commands.Context):
+        """Displays event loop lag and recent slow callbacks."""
+
+        monitor = self.monitor
+        average = monitor.lag_total / monitor.samples if monitor.samples else 0.0
+        lines = [f'Event loop lag: last {monitor.lag_last * 1000:.1f} ms, '
+                 f'avg {average * 1000:.1f} ms, max {monitor.lag_max * 1000:.1f} ms']
+        for at, seconds, description in reversed(monitor.slow):
+            lines.append(f'`{time.strftime("%H:%M:%S", time.localtime(at))}` '
+                         f'{seconds * 1000:.0f} ms: {description}')
+
+        await ctx.send('\n'.join(lines)[:2000])
+
+    @commands.command(name='profile')
+    async def _profile(self, ctx: commands.Context, seconds: float = 10.0):
+        """Samples all threads for `seconds` and displays the hottest functions."""
+
+        seconds = min(max(seconds, 1.0), MAX_PROFILE_SECONDS)
+        async with ctx.typing():
+            samples, functions = await self.bot.loop.run_in_executor(None, profile, seconds)
+
+        lines = [f'{samples} samples over {seconds:.0f} s, own/total % of samples:']
+        for function, count, total in functions:
+            lines.append(f'{count / samples * 100:5.1f} {total / samples * 100:5.1f}  {function}')
+
+        await ctx.send('```\n' + '\n'.join(lines)[:1990] + '\n```')
+
+
+def install(bot: commands.Bot):
+    """
+    Enables diagnostics mode: event loop monitoring and `lag`/`profile` commands.
+    """
+    monitor = LoopMonitor()
+    monitor.start(bot.loop)
+    bot.add_cog(DiagnosticsCog(bot, monitor))
+
+    @bot.before_invoke
+    async def remember_command(ctx: commands.Context):
+        # callbacks of this task are reported with command name
+        current_command.set(ctx.command.qualified_name)
+
+    return monitor
+
+
+metrics.describe('loop_lag_seconds', 'How late event loop wakes up from sleep')
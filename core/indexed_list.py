@@ -0,0 +1,225 @@
+import random
+from collections import deque
+
+
+FRONT_LIMIT = 32  # items pushed to front are kept in deque until there are this many
+
+
+class _Node:
+    # reduce memory usage
+    __slots__ = ('value', 'priority', 'size', 'left', 'right')
+
+    def __init__(self, value):
+        self.value = value
+        self.priority = random.random()
+        self.size = 1
+        self.left = None
+        self.right = None
+
+
+def _size(node: _Node):
+    return node.size if node else 0
+
+
+def _update(node: _Node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _merge(left: _Node, right: _Node):
+    if not left or not right:
+        return left or right
+
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _split(node: _Node, count: int):
+    """
+    Splits tree into first `count` items and the rest.
+    """
+    if not node:
+        return None, None
+
+    if _size(node.left) >= count:
+        left, node.left = _split(node.left, count)
+        _update(node)
+        return left, node
+
+    node.right, right = _split(node.right, count - _size(node.left) - 1)
+    _update(node)
+    return node, right
+
+
+def _build(values):
+    """
+    Builds tree from sequence in O(n).
+    """
+    stack = []
+    for value in values:
+        node = _Node(value)
+        last = None
+        while stack and stack[-1].priority < node.priority:
+            last = stack.pop()
+            _update(last)
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+
+    while len(stack) > 1:
+        _update(stack.pop())
+    if stack:
+        _update(stack[0])
+        return stack[0]
+
+    return None
+
+
+class IndexedList:
+    """
+    Sequence with O(1) amortized push/pop at the front and
+    O(log n) indexed access, insertion and removal.
+
+    Items are kept in implicit treap (randomized balanced tree ordered
+    by position), items pushed to the front are buffered in small
+    deque, so `appendleft()` and `popleft()` don't touch the tree.
+    """
+    def __init__(self, values=()):
+        self._front = deque()
+        self._root = _build(values)
+
+    def __len__(self):
+        return len(self._front) + _size(self._root)
+
+    def __iter__(self):
+        yield from self._front
+        yield from self._iter_tree(0)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return list(self)[item]
+
+            return [value for _, value in zip(range(start, stop), self._iter_from(start))]
+
+        index = self._index(item)
+        if index < len(self._front):
+            return self._front[index]
+
+        node = self._root
+        index -= len(self._front)
+        while True:
+            if index < _size(node.left):
+                node = node.left
+            elif index == _size(node.left):
+                return node.value
+            else:
+                index -= _size(node.left) + 1
+                node = node.right
+
+    def __delitem__(self, index: int):
+        self.pop(index)
+
+    def append(self, value):
+        self._root = _merge(self._root, _Node(value))
+
+    def appendleft(self, value):
+        self._front.appendleft(value)
+        if len(self._front) >= FRONT_LIMIT:
+            self._flush_front()
+
+    def popleft(self):
+        if self._front:
+            return self._front.popleft()
+        if not self._root:
+            raise IndexError('pop from an empty list')
+
+        node, self._root = _split(self._root, 1)
+        return node.value
+
+    def pop(self, index: int = -1):
+        index = self._index(index)
+        if index < len(self._front):
+            value = self._front[index]
+            del self._front[index]
+            return value
+
+        index -= len(self._front)
+        left, rest = _split(self._root, index)
+        node, right = _split(rest, 1)
+        self._root = _merge(left, right)
+        return node.value
+
+    def insert(self, index: int, value):
+        # same semantics as `list.insert()`: index is clamped
+        index = max(0, min(index if index >= 0 else len(self) + index, len(self)))
+        if index == 0:
+            return self.appendleft(value)
+
+        self._flush_front()
+        left, right = _split(self._root, index)
+        self._root = _merge(_merge(left, _Node(value)), right)
+
+    def clear(self):
+        self._front.clear()
+        self._root = None
+
+    def reset(self, values):
+        self._front.clear()
+        self._root = _build(values)
+
+    def _index(self, index: int):
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('list index out of range')
+
+        return index
+
+    def _flush_front(self):
+        if self._front:
+            self._root = _merge(_build(self._front), self._root)
+            self._front.clear()
+
+    def _iter_from(self, start: int):
+        if start < len(self._front):
+            for index in range(start, len(self._front)):
+                yield self._front[index]
+            start = len(self._front)
+
+        yield from self._iter_tree(start - len(self._front))
+
+    def _iter_tree(self, start: int):
+        """
+        In-order traversal starting from `start`-th item of tree,
+        O(log n) to reach first item and O(1) amortized per item.
+        """
+        stack = []
+        node = self._root
+        while node:
+            if start < _size(node.left):
+                stack.append(node)
+                node = node.left
+            elif start == _size(node.left):
+                stack.append(node)
+                break
+            else:
+                start -= _size(node.left) + 1
+                node = node.right
+
+        while stack:
+            node = stack.pop()
+            yield node.value
+
+            node = node.right
+            while node:
+                stack.append(node)
+                node = node.left
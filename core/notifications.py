@@ -0,0 +1,111 @@
+import asyncio
+
+import discord
+
+from audio_sources import metrics
+
+
+NOTIFY_WINDOW = 2.0  # seconds during which enqueue confirmations are merged
+MESSAGE_LIMIT = 2000  # characters allowed in Discord message
+
+
+class Notifier:
+    """
+    Per-guild pipeline of Discord messages, sent by background task,
+    so playback never waits for Discord API.
+
+    "Now playing" status is kept in single message which is edited in place,
+    enqueue confirmations are merged into one message per `NOTIFY_WINDOW`.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+        self._status = None  # sent status message
+        self._pending_status = None  # (channel, embed)
+        self._enqueued = {}  # channel -> list of lines
+        self._messages = []  # (channel, content)
+
+        self._task = loop.create_task(self._run())
+
+    def now_playing(self, channel: discord.abc.Messageable, embed: discord.Embed):
+        # only the latest status matters
+        self._pending_status = (channel, embed)
+        self._wakeup.set()
+
+    def enqueued(self, channel: discord.abc.Messageable, line: str):
+        self._enqueued.setdefault(channel, []).append(line)
+        self._wakeup.set()
+
+    def send(self, channel: discord.abc.Messageable, content: str):
+        self._messages.append((channel, content))
+        self._wakeup.set()
+
+    def close(self):
+        self._task.cancel()
+
+    async def _run(self):
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - self._loop.time(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            while self._messages:
+                channel, content = self._messages.pop(0)
+                await self._safely(channel.send(content))
+
+            if self._pending_status is not None:
+                channel, embed = self._pending_status
+                self._pending_status = None
+                await self._update_status(channel, embed)
+
+            if self._enqueued:
+                if deadline is None:
+                    deadline = self._loop.time() + NOTIFY_WINDOW
+                elif self._loop.time() >= deadline:
+                    deadline = None
+                    await self._flush_enqueued()
+
+    async def _update_status(self, channel: discord.abc.Messageable, embed: discord.Embed):
+        status = self._status
+        # status is edited only while it's the last message in channel,
+        # otherwise nobody would notice the change
+        if status is not None and status.channel == channel and channel.last_message_id == status.id:
+            if await self._safely(status.edit(embed=embed)) is not False:
+                return
+
+        if status is not None:
+            await self._safely(status.delete())
+
+        self._status = await self._safely(channel.send(embed=embed)) or None
+
+    async def _flush_enqueued(self):
+        enqueued, self._enqueued = self._enqueued, {}
+        for channel, lines in enqueued.items():
+            if len(lines) == 1:
+                content = lines[0]
+            else:
+                content = f'Enqueued {len(lines)} songs:\n' + '\n'.join(
+                    line.replace('Enqueued ', '', 1) for line in lines
+                )
+            if len(content) > MESSAGE_LIMIT:
+                content = content[:MESSAGE_LIMIT - 3] + '...'
+
+            await self._safely(channel.send(content))
+
+    @staticmethod
+    async def _safely(coro):
+        """
+        Awaits Discord API call, returns `False` if it failed.
+        """
+        try:
+            with metrics.timer('discord_api_seconds', call=coro.__qualname__):
+                result = await coro
+        except discord.HTTPException:
+            return False
+
+        return True if result is None else result
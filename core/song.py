@@ -1,28 +1,299 @@
 import asyncio
-import itertools
+import functools
+import math
 import random
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
 
 import discord
+from discord.ext import commands
 
-from audio_sources.youtube import YTDLSource
+from audio_sources.replay import REPLAY_BUFFER_SIZE, FrameRecorder, ReplaySource
+from audio_sources.youtube import YTDLError, YTDLSource
+from .indexed_list import IndexedList
+
+
+# re-resolve stream url if it expires within this time
+STREAM_EXPIRY_MARGIN = 5 * 60  # 5 min
+# source prepared in advance is recreated if it waited longer than this,
+# as server might have dropped idle connection
+WARM_TTL = 30  # 30 sec
+
+
+def _sizeof(value):
+    """
+    Approximate memory used by JSON-like `value`, including nested items.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_sizeof(key) + _sizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_sizeof(item) for item in value)
+
+    return size
 
 
 class Song:
     """
     Represents Song object, created from various
     (in this case YouTube) audio sources.
+
+    Song might be unresolved (holds only `query`), resolved
+    (holds `info` dict) or ready to play (holds `source`).
     """
     # reduce memory usage
-    __slots__ = ('source', 'state')
+    __slots__ = ('source', 'state', 'query', 'ctx', 'info', 'resolved_at', 'resolving', 'path', 'frames',
+                 'warmed_at', 'requested_at', '_embed')
 
-    def __init__(self, source: YTDLSource):
+    def __init__(self, source: YTDLSource = None,
+                 *, query: str = None, ctx: commands.Context = None):
         self.source = source
         self.state = 'stream'
 
-    def create_embed(self):
+        self.query = query
+        self.ctx = ctx
+        self.info = source.data if source else None
+        self.resolved_at = time.time() if source else None
+        self.resolving = None
+        self.path = None  # downloaded file in audio cache
+        self.frames = None  # recorded frames of whole song
+        self.warmed_at = None  # when source was prepared in advance
+        self.requested_at = None  # `perf_counter()` of command which should play song right away
+        self._embed = None  # (state, embed) of last `create_embed()` call
+
+    def __str__(self):
+        if self.info is None:
+            return f'`{self.query}`'
+
+        return f'**{self.title}** by **{self.info.get("uploader")}**'
+
+    @property
+    def title(self):
+        return self.info.get('title') if self.info else self.query
+
+    @property
+    def url(self):
+        return self.info.get('webpage_url') if self.info else None
+
+    @property
+    def expires_soon(self):
+        if self.info is None:
+            return False
+
+        # YouTube stream urls carry expiration timestamp
+        expire = parse_qs(urlparse(self.info['url']).query).get('expire')
+        if expire and expire[0].isdigit():
+            expires_at = int(expire[0])
+        else:
+            expires_at = self.resolved_at + YTDLSource.cache.stream_ttl
+
+        return expires_at - time.time() < STREAM_EXPIRY_MARGIN
+
+    async def resolve(self, *, fresh: bool = False):
         """
-        Formats Discord Embed message form prettier output
+        Resolves `query` into `info` dict without spawning FFmpeg.
+        """
+        self.info = await YTDLSource.resolve_info(
+            self.query,
+            guild_id=self.ctx.guild.id,
+            fresh=fresh,
+        )
+        self.resolved_at = time.time()
+
+    def prefetch(self):
+        """
+        Starts background resolution unless song is already resolved.
+        Returns resolution task if it was started.
+        """
+        if self.info is not None or self.resolving is not None:
+            return None
+
+        self.resolving = asyncio.get_event_loop().create_task(self.resolve())
+        # exception is re-raised in `prepare()`, here it's only marked
+        # as retrieved in case song is removed from queue
+        self.resolving.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self.resolving
+
+    @property
+    def warm(self):
+        """
+        Whether source was prepared in advance and can be played as is.
+        """
+        if self.warmed_at is None or self.source is None:
+            return False
+
+        # source which is already crossfaded in must be played anyway
+        return self.source.frames > 0 or time.monotonic() - self.warmed_at < WARM_TTL
+
+    async def prepare(self, *, volume: float = 0.5, prebuffer: int = 0):
+        """
+        Makes song ready to play: waits for resolution,
+        refreshes expiring stream url and creates audio source.
+        If `prebuffer` is set, first frames are decoded in advance.
+        """
+        if self.warm:
+            self.warmed_at = None
+            self.source.volume = volume
+            return
+        self.cool()
+
+        if self.info is None:
+            self.prefetch()
+            try:
+                await self.resolving
+            finally:
+                self.resolving = None
+
+        # song is played again (e.g. `replay` after it ended)
+        if self._collect_frames():
+            self.source = YTDLSource(self.ctx, ReplaySource(self.frames), data=self.info, volume=volume)
+            return
+
+        # previously downloaded songs are played without network
+        path = YTDLSource.audio_cache.lookup(self.info)
+        if path is not None:
+            self._use_file(path)
+        elif self.expires_soon:
+            await self.resolve(fresh=True)
+
+        self.source = YTDLSource.from_info(
+            self.ctx, self.info,
+            volume=volume,
+            path=self.path,
+            record=REPLAY_BUFFER_SIZE,
+            prebuffer=bool(prebuffer),
+        )
+
+        if prebuffer:
+            loop = asyncio.get_event_loop()
+            try:
+                await loop.run_in_executor(None, self.source.buffer.fill, prebuffer)
+            except BaseException:
+                # cancelled or failed, source wouldn't be cooled later
+                self.source.cleanup()
+                self.source = None
+                raise
+            self.warmed_at = time.monotonic()
+
+    def cool(self):
+        """
+        Stops source prepared in advance which wasn't played.
+        """
+        if self.warmed_at is not None:
+            self.warmed_at = None
+            self.source.cleanup()
+            self.source = None
+
+    async def rewind(self, *, volume: float = 0.5):
+        """
+        Recreates source to play song again from the start:
+        from recorded frames if possible, otherwise from downloaded
+        file or stream. Returns `None` if song can't be played.
+        """
+        if self._collect_frames():
+            self.source = YTDLSource(self.ctx, ReplaySource(self.frames), data=self.info, volume=volume)
+            return self.source
+
+        # YTDLSource(PCMVolumeTransformer(AudioSource)) can't be
+        # rewinded, the only way is to recreate it with the same
+        # source, record again unless song is known to be too long
+        recorder = self.source.original if self.source else None
+        overflow = isinstance(recorder, FrameRecorder) and recorder.overflow
+        # probing waits for FFmpeg's first frame, off the event loop
+        loop = asyncio.get_event_loop()
+        try:
+            self.source = await loop.run_in_executor(None, functools.partial(
+                YTDLSource.from_info,
+                self.ctx, self.info,
+                volume=volume,
+                path=self.path,
+                record=0 if overflow else REPLAY_BUFFER_SIZE,
+                probe=True,
+            ))
+        except YTDLError:
+            return None
+
+        return self.source
+
+    async def download(self):
         """
+        Downloads song into audio cache, so it can be replayed.
+        """
+        self.state = 'downloading'
+        try:
+            path = await YTDLSource.download(self.info, guild_id=self.ctx.guild.id)
+        except Exception:
+            self.state = 'stream'
+            raise
+
+        self._use_file(path)
+        self.analyze()
+
+    def analyze(self):
+        """
+        Measures loudness of song in background (once per track),
+        so its next playback is normalized.
+        """
+        keys = (YTDLSource.cache.normalize(self.query),) if self.query else ()
+        asyncio.get_event_loop().create_task(
+            YTDLSource.analyze(self.info, guild_id=self.ctx.guild.id, path=self.path, keys=keys)
+        )
+
+    def release(self):
+        """
+        Frees recorded frames and allows downloaded
+        file to be evicted from audio cache.
+        """
+        self.frames = None
+
+        if self.path is not None:
+            YTDLSource.audio_cache.release(self.path)
+            self.path = None
+            self.state = 'stream'
+
+    def memory(self):
+        """
+        Approximate bytes held by song: metadata,
+        recorded frames and buffered frames of its source.
+        """
+        size = _sizeof(self.info) if self.info else 0
+        if self.frames is not None:
+            size += sum(len(frame) for frame in self.frames)
+
+        source = self.source
+        if source is not None:
+            # the same buffer might be referenced twice
+            buffers = {source.buffer, source.read_ahead}
+            # recorder keeps the same frames as `frames`
+            if self.frames is None:
+                buffers.add(source.original)
+            for buffer in buffers:
+                size += getattr(buffer, 'size', 0)
+
+        return size
+
+    def _collect_frames(self):
+        # keep frames of last complete playback, if any
+        if self.frames is None and self.source and isinstance(self.source.original, FrameRecorder):
+            self.frames = self.source.original.frames
+
+        return self.frames is not None
+
+    def _use_file(self, path: str):
+        if self.path is None:
+            self.path = YTDLSource.audio_cache.acquire(path)
+        self.state = 'downloaded'
+
+    def create_embed(self, *, loop: bool = False, volume: float = 0.5):
+        """
+        Formats Discord Embed message form prettier output.
+        Embed is reused until song state, loop or volume changes.
+        """
+        state = (self.state, self.source.url, loop, int(volume * 100))
+        if self._embed is not None and self._embed[0] == state:
+            return self._embed[1]
+
         embed = (discord
                  .Embed(title='Now playing',
                         description=f'```css\n{self.source.title}\n```',
@@ -30,8 +301,11 @@ class Song:
                  .add_field(name='Duration', value=self.source.duration)
                  .add_field(name='Source',
                             value=f'[Click]({self.source.url})' if self.state == 'stream' else self.state)
-                 .set_thumbnail(url=self.source.thumbnail))
+                 .set_thumbnail(url=self.source.thumbnail)
+                 .add_field(name='Loop', value=loop)
+                 .add_field(name='Volume', value=int(volume * 100)))
 
+        self._embed = (state, embed)
         return embed
 
 
@@ -39,13 +313,29 @@ class SongQueue(asyncio.Queue):
     """
     Represents queue of songs aka playlist
     """
+    ITEMS_PER_PAGE = 10
+
+    def _init(self, maxsize: int):
+        # indexed list instead of deque, so songs can be
+        # inserted, moved and removed anywhere in O(log n)
+        self._queue = IndexedList()
+
+        # incremented on every change, rendered pages
+        # are reused while it stays the same
+        self.version = 0
+        self._pages = {}
+        self._pages_version = 0
+
+    def _put(self, item):
+        self._queue.append(item)
+        self.touch()
+
+    def _get(self):
+        self.touch()
+        return self._queue.popleft()
+
     def __getitem__(self, item):
-        if isinstance(item, slice):
-            return list(
-                itertools.islice(self._queue, item.start, item.stop, item.step)
-            )
-        else:
-            return self._queue[item]
+        return self._queue[item]
 
     def __iter__(self):
         return self._queue.__iter__()
@@ -53,11 +343,74 @@ class SongQueue(asyncio.Queue):
     def __len__(self):
         return self.qsize()
 
+    def touch(self):
+        self.version += 1
+
     def clear(self):
+        # songs might be already prepared to play next
+        for song in self._queue:
+            song.cool()
         self._queue.clear()
+        self.touch()
 
     def shuffle(self):
-        random.shuffle(self._queue)
+        songs = list(self._queue)
+        random.shuffle(songs)
+        self._queue.reset(songs)
+        self.touch()
 
     def remove(self, index: int):
-        del self._queue[index]
+        # song might be already prepared to play next
+        self._queue.pop(index).cool()
+        self.touch()
+
+    def move(self, index: int, position: int):
+        self._queue.insert(position, self._queue.pop(index))
+        self.touch()
+
+    def insert(self, position: int, item):
+        """
+        Puts item at given position, waking up waiting `get()`.
+        """
+        self._queue.insert(position, item)
+        self.touch()
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        self._wakeup_next(self._getters)
+
+    def put_front(self, item):
+        self.insert(0, item)
+
+    def create_embed(self, page: int = 1):
+        """
+        Formats given page of queue, pages are rendered
+        once per queue version.
+        """
+        if self._pages_version != self.version:
+            self._pages.clear()
+            self._pages_version = self.version
+
+        embed = self._pages.get(page)
+        if embed is not None:
+            return embed
+
+        pages = math.ceil(len(self) / self.ITEMS_PER_PAGE)
+
+        start = (page - 1) * self.ITEMS_PER_PAGE
+        end = start + self.ITEMS_PER_PAGE
+
+        queue = []
+        for i, song in enumerate(self[start:end], start=start):
+            if song.url:
+                queue.append(f'`{i}.` [**{song.title}**]({song.url})')
+            else:
+                queue.append(f'`{i}.` **{song.title}**')
+
+        embed = (
+            discord.Embed(
+                description=f'**{len(self)} tracks:**\n\n' + '\n'.join(queue),
+                color=discord.Color.from_rgb(69, 38, 53))
+            .set_footer(text=f'Viewing page {page}/{pages}')
+        )
+        self._pages[page] = embed
+        return embed
@@ -1,16 +1,25 @@
 import asyncio
-import os
+import functools
+import time
+import traceback
 from async_timeout import timeout
 
-from discord import FFmpegPCMAudio
 from discord.ext import commands
 
-from audio_sources.youtube import YTDLSource
-from .song import SongQueue
+from audio_sources import metrics
+from audio_sources.youtube import YTDLError, YTDLSource
+from .broadcast import Station
+from .notifications import Notifier
+from .song import Song, SongQueue
 
 
 SONG_QUEUE_TIMEOUT = 600  # 5 min
 # SONG_QUEUE_TIMEOUT = 30  # 30 sec
+PREFETCH_AHEAD = 2  # number of queued songs resolved in background
+PLAYLIST_BUFFER = 20  # max number of queued songs before playlist ingestion pauses
+PREWARM_SECONDS = 5  # next song's source is prepared this long before current one ends
+PREBUFFER_FRAMES = 50  # 1 sec of audio decoded in advance
+CROSSFADE_SECONDS = 0  # overlap of consecutive songs, 0 disables crossfade
 
 
 class Voice:
@@ -25,16 +34,26 @@ class Voice:
         self.current = None
         self.next = asyncio.Event()
         self.songs = SongQueue()
+        self.song_taken = asyncio.Event()
+        self.playlists = []  # ingestion tasks, processed one after another
         self.voice = None
+        self.notifier = Notifier(bot.loop)
+        self.prewarm = None  # task preparing next song in advance
+        self.warmed = None  # song prepared by `prewarm`, until it's played
+        self.station = None  # broadcast Station this guild is tuned in
+        self._listener = None
 
         self._loop = False
+        self._replay = False
         self._volume = 0.5
+        self.last_active = time.monotonic()
 
         # create EventLoop with player task
         self.start_player()
 
     def __del__(self):
         self.audio_player.cancel()
+        self.notifier.close()
 
     @property
     def loop(self):
@@ -42,13 +61,13 @@ class Voice:
 
     @loop.setter
     def loop(self, value: bool):
+        # downloaded file stays in audio cache and
+        # is released when song is done
         self._loop = value
 
-        if not self.loop:
-            # throw away downloaded file when loop is off
-            # or song was skipped
-            if os.path.isfile(f'{self.bot.command_prefix}.mp3'.replace('..', '.')):
-                os.remove(f'{self.bot.command_prefix}.mp3'.replace('..', '.'))
+        # looped song shouldn't fade into next one
+        if value and self.current and self.current.source:
+            self.current.source.crossfade(None)
 
     @property
     def volume(self):
@@ -56,42 +75,54 @@ class Voice:
 
     @volume.setter
     def volume(self, value: float):
-        self._volume = self.current.source.volume = value
+        self._volume = value
+        # song might have failed to prepare
+        if self.current and self.current.source:
+            self.current.source.volume = value
 
     @property
     def is_playing(self):
         return self.voice and self.current
 
+    @property
+    def idle_for(self):
+        """
+        Seconds since guild state was last used, 0 while audio is playing.
+        """
+        if self.station is not None or (self.voice and self.voice.is_playing()):
+            return 0.0
+
+        return time.monotonic() - self.last_active
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def memory(self):
+        """
+        Approximate bytes held by current and queued songs.
+        """
+        size = self.current.memory() if self.current else 0
+        return size + sum(song.memory() for song in self.songs)
+
     async def audio_player_task(self):
         while True:
             self.next.clear()
 
-            if self.loop:
-                # YTDLSource(PCMVolumeTransformer(AudioSource)) can't be
-                # rewinded, the only way is to recreate it with the same
-                # source
-                if self.current.state == 'downloaded':
-                    recreated_source = FFmpegPCMAudio(f'{self.bot.command_prefix}.mp3'.replace('..', '.'))
-                else:
-                    recreated_source = FFmpegPCMAudio(
-                        self.current.source.stream_url,
-                        **YTDLSource.FFMPEG_OPTIONS,
-                    )
-                # if FFmpegPCMAudio fails to read source (e.g. file is missing or
-                # failed to connect to server), .read() returns b''
-                if not recreated_source.read():
+            if self.loop or self._replay:
+                self._replay = False
+
+                # if source can't be recreated (e.g. file is missing or
+                # failed to connect to server), looping is stopped
+                if await self.current.rewind(volume=self.volume) is None:
                     self.loop = False
                     self.voice.stop()
                     self.next.set()
                 else:
-                    self.current.source = YTDLSource(
-                        self._ctx,
-                        recreated_source,
-                        data=self.current.source.data,
-                        volume=self.volume,
-                    )
-                    self.voice.play(self.current.source, after=self.play_next_song)
+                    self._play(self.current.source)
+                    self.touch()
             else:
+                previous = self.current
+
                 # Try to get the next song from SongQueue within
                 # given timeout. If no song will be added to the
                 # queue in time, the player will disconnect due
@@ -99,25 +130,203 @@ class Voice:
                 try:
                     async with timeout(SONG_QUEUE_TIMEOUT):
                         self.current = await self.songs.get()
+                        self.song_taken.set()
+                    self.stop_prewarm()
+                    self._cool_warmed(keep=self.current)
+
+                    # recorded frames and downloaded file of finished song
+                    # are freed only now, as song still can be replayed
+                    if previous and previous is not self.current:
+                        previous.release()
                 except asyncio.TimeoutError:
-                    await self.current.source.channel.send(
+                    # guild listening to broadcast stays connected
+                    if self.station is not None:
+                        continue
+
+                    ctx = self.current.ctx if self.current else self._ctx
+                    await ctx.channel.send(
                         f'No new songs in queue for {SONG_QUEUE_TIMEOUT} seconds. Bot now disconnects.'
                     )
                     self.bot.loop.create_task(self.suspend())
                     self.exists = False
                     return
 
-                # feedback to Discord (feedback on loop can produce spam)
-                await self.current.source.channel.send(
-                    embed=self.current.create_embed()
-                    .add_field(name='Loop', value=self.loop)
-                    .add_field(name='Volume', value=int(self.volume * 100))
+                # songs are enqueued unresolved, resolution of this one
+                # should already be done or in progress by `prefetch()`
+                try:
+                    with metrics.timer('prepare_seconds'):
+                        await self.current.prepare(volume=self.volume)
+                except Exception as e:
+                    # any failure drops the song, player goes on with the next one
+                    if not isinstance(e, YTDLError):
+                        traceback.print_exc()
+                    self.notifier.send(
+                        self.current.ctx.channel,
+                        f'An error occurred while processing `{self.current.query}`: {str(e)}',
+                    )
+                    # song without source can't be shown, looped or replayed
+                    self.current = None
+                    continue
+
+                # own queue takes over broadcast
+                self.untune()
+                self._play(self.current.source, requested_at=self.current.requested_at)
+                # only the first playback answers the command
+                self.current.requested_at = None
+                self.touch()
+
+                # feedback to Discord (feedback on loop can produce spam),
+                # sent in background after playback has started
+                self.notifier.now_playing(
+                    self.current.source.channel,
+                    self.current.create_embed(loop=self.loop, volume=self.volume),
+                )
+                self.prefetch()
+                self.current.analyze()
+                self.bot.loop.run_in_executor(
+                    None,
+                    functools.partial(YTDLSource.history.record, self.current.info, played=True),
                 )
 
-                self.voice.play(self.current.source, after=self.play_next_song)
+            self.stop_prewarm()
+            self.prewarm = self.bot.loop.create_task(self._prewarm_next(self.current))
 
             await self.next.wait()
 
+    def _play(self, source: YTDLSource, *, requested_at: float = None):
+        if metrics.enabled:
+            # frames are timed as they are handed to voice client
+            source = metrics.TimedSource(source, stage='play', jitter=True, requested_at=requested_at)
+        self.voice.play(source, after=self.play_next_song)
+
+    def prefetch(self):
+        """
+        Resolves next `PREFETCH_AHEAD` songs in background,
+        so they are ready when current song ends.
+        """
+        # queue might have been reordered
+        if self.warmed is not None and (not self.songs or self.songs[0] is not self.warmed):
+            self._cool_warmed()
+            if self.current and self.current.source and self.station is None:
+                # new next song is prepared instead
+                self.prewarm = self.bot.loop.create_task(self._prewarm_next(self.current))
+
+        for song in self.songs[0:PREFETCH_AHEAD]:
+            task = song.prefetch()
+            if task is not None:
+                # resolved song gets its title in queue
+                task.add_done_callback(lambda task: self.songs.touch())
+
+    async def _prewarm_next(self, song: Song):
+        """
+        Prepares next song `PREWARM_SECONDS` before `song` ends:
+        spawns FFmpeg and decodes first frames, so there is no
+        gap between songs. Crossfades them if enabled.
+        """
+        source = song.source
+        duration = source.data.get('duration')
+        if not duration:
+            return
+
+        # playback can't be faster than real time, but can be paused
+        while duration - source.elapsed > PREWARM_SECONDS:
+            await asyncio.sleep(duration - source.elapsed - PREWARM_SECONDS)
+
+        if self.loop or not self.songs:
+            return
+
+        upcoming = self.songs[0]
+        try:
+            await upcoming.prepare(volume=self.volume, prebuffer=PREBUFFER_FRAMES)
+        except Exception:
+            # reported when song is taken from queue
+            return
+        self.warmed = upcoming
+
+        if CROSSFADE_SECONDS and not source.is_opus() and not upcoming.source.is_opus():
+            frames = int(CROSSFADE_SECONDS / source.FRAME_LENGTH)
+            end = int(duration / source.FRAME_LENGTH)
+            source.crossfade(upcoming.source, at=end - frames, frames=frames)
+
+    def tune(self, station: Station):
+        """
+        Stops own playback and plays broadcast `station` instead.
+        """
+        self.untune()
+        self.loop = False
+        self._replay = False
+        self.stop_prewarm()
+        self.stop_playlists()
+        self.songs.clear()
+        if self.voice.is_playing() or self.voice.is_paused():
+            self.voice.stop()
+
+        # stopped song is over, it's not shown, skipped or replayed anymore
+        if self.current is not None:
+            self.current.release()
+            self.current = None
+
+        self.station = station
+        self._listener = station.subscribe()
+        self.voice.play(self._listener)
+
+    def untune(self):
+        if self.station is None:
+            return
+
+        self.station.unsubscribe(self._listener)
+        self.station = self._listener = None
+        if self.voice:
+            self.voice.stop()
+
+    def _cool_warmed(self, *, keep: Song = None):
+        """
+        Stops source prepared in advance for song which isn't next anymore.
+        """
+        if self.warmed is not None and self.warmed is not keep:
+            self.stop_prewarm()
+            # current song shouldn't fade into it
+            if self.current and self.current.source and self.current is not keep:
+                self.current.source.crossfade(None)
+            self.warmed.cool()
+        self.warmed = None
+
+    def stop_prewarm(self):
+        if self.prewarm is not None:
+            self.prewarm.cancel()
+            self.prewarm = None
+
+    def add_playlist(self, ctx: commands.Context, url: str):
+        """
+        Enqueues playlist entries in background, in batches,
+        keeping at most `PLAYLIST_BUFFER` songs in queue.
+        """
+        previous = self.playlists[-1] if self.playlists else None
+        task = self.bot.loop.create_task(self._ingest_playlist(ctx, url, previous))
+        task.add_done_callback(self.playlists.remove)
+        self.playlists.append(task)
+
+    async def _ingest_playlist(self, ctx: commands.Context, url: str,
+                               previous: asyncio.Task = None):
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        try:
+            async for urls in YTDLSource.iter_playlist(url, guild_id=ctx.guild.id):
+                for song_url in urls:
+                    await self.songs.put(Song(query=song_url, ctx=ctx))
+                self.prefetch()
+
+                while len(self.songs) >= PLAYLIST_BUFFER:
+                    self.song_taken.clear()
+                    await self.song_taken.wait()
+        except YTDLError as e:
+            self.notifier.send(ctx.channel, f'An error occurred while processing this playlist: {str(e)}')
+
+    def stop_playlists(self):
+        for task in self.playlists:
+            task.cancel()
+
     def start_player(self):
         self.audio_player = self.bot.loop.create_task(self.audio_player_task())
 
@@ -125,7 +334,21 @@ class Voice:
         if error:
             raise VoiceError(str(error))
 
-        self.next.set()
+        # called from voice client thread, event loop has to be
+        # woken up, otherwise player waits for unrelated event
+        self.bot.loop.call_soon_threadsafe(self.next.set)
+
+    def replay(self):
+        """
+        Plays current song again from the start,
+        from memory if it was fully recorded.
+        """
+        if self.voice.is_playing() or self.voice.is_paused():
+            self._replay = True
+            self.voice.stop()
+        else:
+            # song has ended already, player waits for next one
+            self.songs.put_front(self.current)
 
     def skip(self):
         if self.is_playing:
@@ -133,14 +356,33 @@ class Voice:
             self.voice.stop()
 
     async def suspend(self):
+        if self.current:
+            self.current.release()
         self.current = None
         self.loop = False
+        self.untune()
+        self.stop_prewarm()
+        self.stop_playlists()
         self.songs.clear()
 
         if self.voice:
             await self.voice.disconnect()
             self.voice = None
 
+    async def close(self):
+        """
+        Frees everything guild state holds: stops FFmpeg,
+        cancels background tasks and disconnects.
+        """
+        current = self.current
+        await self.suspend()
+        # source is cleaned up by voice client only if it was playing
+        if current is not None and current.source is not None:
+            current.source.cleanup()
+
+        self.audio_player.cancel()
+        self.notifier.close()
+
 
 class VoiceError(Exception):
     pass
@@ -0,0 +1,155 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+
+STATS_INTERVAL = 60  # seconds between stats reports of workers
+RESTART_DELAY = 1  # seconds before crashed worker is restarted, doubled on every crash
+MAX_RESTART_DELAY = 60
+STABLE_UPTIME = 300  # worker running this long is considered healthy, its delay is reset
+
+
+def run_worker(bot_name: str, bot_token: str, shard_id: int, shard_count: int,
+               stats: multiprocessing.Queue):
+    """
+    Entry point of worker process: runs bot for one shard,
+    reports its stats every `STATS_INTERVAL`.
+    """
+    # imported in worker, so supervisor doesn't load discord and youtube-dl
+    from bot import create_bot
+
+    bot = create_bot(bot_name, shard_id=shard_id, shard_count=shard_count)
+    cog = bot.get_cog('AudioStreamerCog')
+
+    async def report():
+        await bot.wait_until_ready()
+        while not bot.is_closed():
+            stats.put((shard_id, cog.stats()))
+            await asyncio.sleep(STATS_INTERVAL)
+
+    bot.loop.create_task(report())
+    bot.run(bot_token)
+
+
+class Supervisor:
+    """
+    Runs one bot process per shard, so guilds are split
+    between processes (and CPU cores) instead of sharing one GIL.
+    Discord sends events of guild to shard `(guild_id >> 22) % workers`.
+    Restarts crashed workers and prints their stats.
+    """
+    def __init__(self, bot_name: str, bot_token: str, workers: int):
+        self.bot_name = bot_name
+        self.bot_token = bot_token
+        self.workers = workers
+
+        self._context = multiprocessing.get_context('spawn')
+        self._stats = self._context.Queue()
+        self._processes = {}  # shard_id -> (process, started_at)
+        self._delays = {}  # shard_id -> restart delay
+        self._restart_at = {}  # shard_id -> time of scheduled restart
+        self.latest = {}  # shard_id -> last reported stats
+
+    def start(self, shard_id: int):
+        # downloaded files are reference counted by process,
+        # so every worker gets its own audio cache
+        environ = {
+            'AUDIO_STREAMER_AUDIO_CACHE': os.path.join(
+                os.environ.get('AUDIO_STREAMER_AUDIO_CACHE', 'audio_cache'), str(shard_id),
+            ),
+        }
+        # as well as metrics endpoint and file
+        if os.environ.get('AUDIO_STREAMER_METRICS_PORT'):
+            environ['AUDIO_STREAMER_METRICS_PORT'] = str(int(os.environ['AUDIO_STREAMER_METRICS_PORT']) + shard_id)
+        if os.environ.get('AUDIO_STREAMER_METRICS_FILE'):
+            environ['AUDIO_STREAMER_METRICS_FILE'] = f'{os.environ["AUDIO_STREAMER_METRICS_FILE"]}.{shard_id}'
+
+        saved = {name: os.environ.get(name) for name in environ}
+        os.environ.update(environ)
+        try:
+            process = self._context.Process(
+                target=run_worker,
+                args=(self.bot_name, self.bot_token, shard_id, self.workers, self._stats),
+                name=f'shard-{shard_id}',
+            )
+            process.start()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    del os.environ[name]
+                else:
+                    os.environ[name] = value
+
+        self._processes[shard_id] = (process, time.monotonic())
+
+    def run(self):
+        for shard_id in range(self.workers):
+            self.start(shard_id)
+
+        reported_at = time.monotonic()
+        try:
+            while True:
+                try:
+                    shard_id, stats = self._stats.get(timeout=1)
+                    self.latest[shard_id] = stats
+                except queue.Empty:
+                    pass
+
+                self._check()
+                if time.monotonic() - reported_at >= STATS_INTERVAL:
+                    reported_at = time.monotonic()
+                    self.report()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        for process, _ in self._processes.values():
+            process.terminate()
+        for process, _ in self._processes.values():
+            process.join()
+
+    def report(self):
+        totals = {}
+        for stats in self.latest.values():
+            for name in ('guilds', 'voice_states', 'playing', 'stations'):
+                totals[name] = totals.get(name, 0) + stats[name]
+
+        alive = sum(1 for process, _ in self._processes.values() if process.is_alive())
+        print(f'workers: {alive}/{self.workers}, ' + ', '.join(f'{name}: {value}' for name, value in totals.items()))
+        for shard_id, stats in sorted(self.latest.items()):
+            cache = stats['metadata_cache']
+            print(f'  shard {shard_id}: guilds: {stats["guilds"]}, playing: {stats["playing"]}, '
+                  f'memory: {stats["memory"] // 1024} KiB, '
+                  f'cache hits: {cache["hits"]}, misses: {cache["misses"]}')
+
+    def _check(self):
+        now = time.monotonic()
+        for shard_id, (process, started_at) in list(self._processes.items()):
+            if process.is_alive():
+                if now - started_at >= STABLE_UPTIME:
+                    self._delays.pop(shard_id, None)
+                continue
+
+            if shard_id not in self._restart_at:
+                delay = self._delays.get(shard_id, RESTART_DELAY)
+                self._delays[shard_id] = min(delay * 2, MAX_RESTART_DELAY)
+                self._restart_at[shard_id] = now + delay
+                self.latest.pop(shard_id, None)
+                print(f'shard {shard_id} exited with code {process.exitcode}, restarting in {delay} s')
+            elif now >= self._restart_at[shard_id]:
+                del self._restart_at[shard_id]
+                self.start(shard_id)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        print('Usage: supervisor.py <bot name> <bot token> [workers]')
+        sys.exit(2)
+
+    workers = int(sys.argv[3]) if len(sys.argv) == 4 else os.cpu_count() or 1
+    Supervisor(sys.argv[1], sys.argv[2], workers).run()